@@ -0,0 +1,65 @@
+import re
+import sqlite3
+import unicodedata
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+MATCH_THRESHOLD = 0.9  # Lowest score of a search result that is taken as the artist
+
+
+class ArtistMatcher:
+    """Matches artist names to YouTube Music search results and remembers confirmed matches as aliases."""
+
+    def __init__(self, db: Optional[sqlite3.Connection], writer=None, threshold: float = MATCH_THRESHOLD):
+        """Initialize matcher; aliases persist in the aliases table of db, or for the run without one."""
+        self.db = db
+        self.writer = writer  # Batches alias writes with the caller's other writes
+        self.threshold = threshold
+        self.aliases: Dict[str, Dict] = {}  # Normalized name -> artist_info, looked up or learnt in this run
+
+    def normalize(self, name: str) -> str:
+        """Reduce a name to a comparable key: no case, diacritics, leading "the", "&" or punctuation."""
+        name = unicodedata.normalize("NFKD", name)
+        name = "".join(c for c in name if not unicodedata.combining(c)).lower()
+        name = name.replace("&", " and ").replace("+", " and ")
+        name = re.sub(r"[^\w\s]|_", " ", name)
+        name = re.sub(r"^the\s+", "", name.strip())
+        return " ".join(name.split())
+
+    def score(self, name: str, candidate: str) -> float:
+        """Return the similarity of two names from 0 to 1 after normalizing both."""
+        a, b = self.normalize(name), self.normalize(candidate)
+        if a == b:
+            return 1.0
+        if a.replace(" ", "") == b.replace(" ", ""):
+            return 0.99  # Only spacing differs, e.g. "AC DC" and "ACDC"
+        return SequenceMatcher(None, a, b).ratio()
+
+    def best(self, name: str, search_results: List[Dict]) -> Tuple[Optional[Dict], float]:
+        """Return the best scoring search result and its score; ties go to the higher ranked result."""
+        best, best_score = None, 0.0
+        for result in search_results:
+            if not result.get("artist") or not result.get("browseId"):
+                continue
+            result_score = self.score(name, result["artist"])
+            if result_score > best_score:
+                best, best_score = result, result_score
+        return best, best_score
+
+    def lookup(self, name: str) -> Optional[Dict]:
+        """Return the remembered artist_info of a name, None if it has never been matched."""
+        key = self.normalize(name)
+        if key not in self.aliases and self.db:
+            row = self.db.execute("SELECT artist, browse_id FROM aliases WHERE name=?", (key,)).fetchone()
+            if row:
+                self.aliases[key] = {"artist": row[0], "browseId": row[1]}
+        return self.aliases.get(key)
+
+    def remember(self, name: str, artist_info: Dict) -> None:
+        """Store a confirmed match so later lookups of the name need no search."""
+        key = self.normalize(name)
+        self.aliases[key] = {"artist": artist_info["artist"], "browseId": artist_info["browseId"]}
+        if self.writer:
+            self.writer.execute("INSERT INTO aliases VALUES(?, ?, ?) "
+                                "ON CONFLICT(name) DO UPDATE SET artist=excluded.artist, browse_id=excluded.browse_id",
+                                (key, artist_info["artist"], artist_info["browseId"]))
@@ -1,17 +1,30 @@
 import paramiko
+import os
+import json
 import time
 import sys
 import requests
 import sqlite3
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from database import Database
 
 class ChangeFiberIP:
+    # Environment variables without which the router cannot be reached; router_password may be empty for key logins
+    REQUIRED_SETTINGS = ("router_ip", "router_username", "router_interface", "ip_check_url")
+
+    @classmethod
+    def configured(cls):
+        """Return True if the environment names a router to rotate the IP with."""
+        return all(os.getenv(name) for name in cls.REQUIRED_SETTINGS)
+
     def __init__(self, sqlite3_file, table, days=30):
         """Initialize the IP change module with database and router settings."""
         # Database configuration
         self.sqlite3_file = sqlite3_file
         self.table = table
         self.days = days
+        self.database = Database(sqlite3_file)  # Shared with the downloader processes
+        self.addresses = {}  # Cached view of the table: ip -> (date, status)
 
         # Router configuration
         self.router_ip = os.getenv("router_ip")
@@ -24,50 +37,74 @@ class ChangeFiberIP:
         self.max_attempts_per_cycle = 5
         self.max_cycles = 5
         self.retry_wait_seconds = 3600  # 1 hour
+        self.failed_cycles = 0
+        self.next_cycle = 0  # Earliest time for change_ip to start another cycle after a failed one
+
+        # Router connection, kept open across rotations
+        self.client = None
+        self.mac = None  # MAC address set by the last successful change
+
+        # Readiness polling after a MAC change
+        self.poll_initial = 1  # Seconds before the first check, doubled after every miss
+        self.poll_max = 16
+        self.ready_timeout = 120  # Give up waiting for a new lease after this long
 
         # Initialize database
         self._init_db()
 
+    def _conn(self):
+        """Return this thread's own connection; it stays open for the life of the process.
+
+        It is never the caller's connection, whose open write batch the commits here would break up.
+        """
+        return self.database.connection()
+
     def _init_db(self):
-        """Initialize the SQLite database and create the table if it doesn't exist."""
+        """Initialize the SQLite database, create the table if it doesn't exist and load the cached view."""
         try:
-            conn = sqlite3.connect(self.sqlite3_file)
-            cursor = conn.cursor()
-            cursor.execute(f"""
+            conn = self._conn()
+            conn.execute(f"""
                 CREATE TABLE IF NOT EXISTS {self.table} (
                     ip TEXT PRIMARY KEY,
                     date INTEGER,
                     status INTEGER
                 )
             """)
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_date_status ON {self.table} (date, status)")
             conn.commit()
-            conn.close()
+            self._load_addresses()
             # ~ print(f"Database {self.sqlite3_file} initialized with table {self.table}.")
         except sqlite3.Error as e:
             print(f"Failed to initialize database: {e}")
             sys.exit(1)
 
-    def _check_ip_in_db(self, ip):
-        """Check if the IP exists in the database and return its status and date."""
+    def _load_addresses(self):
+        """Read the whole table into the cached view, picking up changes made by other processes."""
         try:
-            conn = sqlite3.connect(self.sqlite3_file)
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT date, status FROM {self.table} WHERE ip = ?", (ip,))
-            result = cursor.fetchone()
-            conn.close()
-            return result  # Returns (date, status) or None if not found
+            rows = self._conn().execute(f"SELECT ip, date, status FROM {self.table}").fetchall()
+            self.addresses = {ip: (date, status) for ip, date, status in rows}
         except sqlite3.Error as e:
-            print(f"Failed to check IP in database: {e}")
-            return None
+            print(f"Failed to load IP addresses: {e}")
+
+    def _check_ip_in_db(self, ip):
+        """Check if the IP exists in the database and return its status and date."""
+        return self.addresses.get(ip)  # Returns (date, status) or None if not found
+
+    def _write_ip(self, ip, today_date, status=None):
+        """Insert or update an IP in the database and the cached view; status None keeps the current one."""
+        old_status = self.addresses.get(ip, (None, 0))[1]
+        status = old_status if status is None else status
+        conn = self._conn()
+        conn.execute(f"INSERT INTO {self.table} (ip, date, status) VALUES (?, ?, ?) "
+                     f"ON CONFLICT(ip) DO UPDATE SET date = excluded.date, status = excluded.status",
+                     (ip, today_date, status))
+        conn.commit()
+        self.addresses[ip] = (today_date, status)
 
     def _update_ip_date(self, ip, today_date):
         """Update the date of an existing IP in the database."""
         try:
-            conn = sqlite3.connect(self.sqlite3_file)
-            cursor = conn.cursor()
-            cursor.execute(f"UPDATE {self.table} SET date = ? WHERE ip = ?", (today_date, ip))
-            conn.commit()
-            conn.close()
+            self._write_ip(ip, today_date)
             print(f"Updated date for IP {ip} to {today_date}")
         except sqlite3.Error as e:
             print(f"Failed to update IP date: {e}")
@@ -75,16 +112,16 @@ class ChangeFiberIP:
     def _insert_new_ip(self, ip, today_date):
         """Insert a new IP into the database with today's date and status = 0."""
         try:
-            conn = sqlite3.connect(self.sqlite3_file)
-            cursor = conn.cursor()
-            cursor.execute(f"INSERT INTO {self.table} (ip, date, status) VALUES (?, ?, ?)", (ip, today_date, 0))
-            conn.commit()
-            conn.close()
+            self._write_ip(ip, today_date, 0)
             print(f"Inserted new IP {ip} with date {today_date} and status 0")
         except sqlite3.Error as e:
             print(f"Failed to insert new IP: {e}")
 
-    def _is_ip_invalid(self, ip_info, today_date):
+    def _cutoff_date(self):
+        """Return the date, as YYYYMMDD integer, before which an IP is old enough to use again."""
+        return int((datetime.now() - timedelta(days=self.days)).strftime("%Y%m%d"))
+
+    def _is_ip_invalid(self, ip_info):
         """Check if the IP is banned (status = 1) or too recent (less than self.days old)."""
         if not ip_info:
             return False  # IP not in database, not invalid
@@ -92,20 +129,20 @@ class ChangeFiberIP:
         if status == 1:
             print(f"IP is banned (status = 1)")
             return True
-        thirty_days_ago = int((datetime.strptime(str(today_date), "%Y%m%d") - timedelta(days=self.days)).strftime("%Y%m%d"))
-        if ip_date > thirty_days_ago:
+        if ip_date > self._cutoff_date():
             print(f"IP is too recent (date {ip_date}, less than {self.days} days ago)")
             return True
         return False
 
-    def _get_public_ip(self):
+    def _get_public_ip(self, quiet=False):
         """Fetch the current public IP address from the specified URL."""
         try:
             response = requests.get(self.ip_check_url, timeout=10)
             response.raise_for_status()
             return response.text.strip()
         except requests.RequestException as e:
-            print(f"Failed to fetch public IP: {e}")
+            if not quiet:
+                print(f"Failed to fetch public IP: {e}")
             return None
 
     def _ssh_connect(self):
@@ -114,15 +151,33 @@ class ChangeFiberIP:
             client = paramiko.SSHClient()
             client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             client.connect(self.router_ip, username=self.username, password=self.password, timeout=10)
+            client.get_transport().set_keepalive(30)
             return client
         except Exception as e:
             print(f"Failed to connect: {e}")
             return None
 
-    def _execute_command(self, client, command):
+    def _ssh(self):
+        """Return the open SSH connection to the router, reconnecting if it was dropped, e.g. by a network restart."""
+        transport = self.client.get_transport() if self.client else None
+        if not transport or not transport.is_active():
+            self.close()
+            self.client = self._ssh_connect()
+        return self.client
+
+    def close(self):
+        """Close the SSH connection to the router."""
+        if self.client:
+            self.client.close()
+            self.client = None
+
+    def _execute_command(self, command):
         """Execute a command via SSH and return the output."""
+        client = self._ssh()
+        if not client:
+            return None
         try:
-            stdin, stdout, stderr = client.exec_command(command)
+            stdin, stdout, stderr = client.exec_command(command, timeout=30)
             output = stdout.read().decode().strip()
             error = stderr.read().decode().strip()
             if error:
@@ -130,45 +185,83 @@ class ChangeFiberIP:
             return output
         except Exception as e:
             print(f"Command execution failed: {e}")
+            self.close()  # Reconnect on the next command
             return None
 
-    def _change_mac_address(self, client):
+    def _run_script(self, commands):
+        """Run (key, command) pairs as one shell script in a single channel; returns {key: (exit code, output)}."""
+        script = "\n".join(
+            f"out=$( {command} 2>&1); rc=$?; printf '%s\\t%s\\t%s\\n' {key} \"$rc\" \"$(printf %s \"$out\" | tr '\\n' ' ')\""
+            for key, command in commands)
+        output = self._execute_command(script)
+        results = {}
+        for line in (output or "").splitlines():
+            key, rc, value = (line.split("\t", 2) + ["", ""])[:3]
+            if rc.isdigit():
+                results[key] = (int(rc), value.strip())
+        return results
+
+    def _change_mac_address(self):
         """Change the MAC address of the specified network interface using UCI."""
         try:
-            # Get current MAC address
-            fetch_cmd = f"uci get network.{self.interface}.macaddr"
-            mac_addr = self._execute_command(client, fetch_cmd)
+            # Current MAC address, known from the previous attempt after the first one
+            mac_addr = self.mac or self._execute_command(f"uci get network.{self.interface}.macaddr")
             bytes = mac_addr.split(":")
             val = int(bytes[3], 16) + 1
             bytes[3] = f"{val if val<=254 else 1:02X}"
             new_mac = ":".join(bytes)
             print(f"Incrementing MAC address from {mac_addr} to {new_mac}...")
 
-            # Set the new MAC address
-            set_mac_cmd = f"uci set network.{self.interface}.macaddr='{new_mac}'"
-            self._execute_command(client, set_mac_cmd)
-
-            # Commit the changes
-            commit_cmd = "uci commit network"
-            self._execute_command(client, commit_cmd)
-
-            # Restart the network to apply changes
-            restart_cmd = "/etc/init.d/network restart"
-            self._execute_command(client, restart_cmd)
-
-            # Verify the change
-            fetch_cmd = f"uci get network.{self.interface}.macaddr"
-            mac_addr = self._execute_command(client, fetch_cmd)
+            # Set, commit and verify in one round-trip; the restart runs detached because it drops the link
+            results = self._run_script([
+                ("set", f"uci set network.{self.interface}.macaddr='{new_mac}'"),
+                ("commit", "uci commit network"),
+                ("macaddr", f"uci get network.{self.interface}.macaddr"),
+                ("restart", "( sleep 1; /etc/init.d/network restart ) </dev/null >/dev/null 2>&1 &"),
+            ])
+            for key in ("set", "commit"):
+                if results.get(key, (1, ""))[0]:
+                    print(f"Command error: {key}: {results.get(key, (1, 'no answer'))[1]}")
+            mac_addr = results.get("macaddr", (1, None))[1]
             if mac_addr == new_mac:
+                self.mac = new_mac
                 print(f"Successfully changed MAC address of {self.interface} to {new_mac}")
                 return True
             else:
+                self.mac = None  # Read it again next time
                 print(f"Failed to verify MAC address change. Current MAC: {mac_addr}")
                 return False
         except Exception as e:
+            self.mac = None
             print(f"Failed to change MAC address: {e}")
             return False
 
+    def _wan_is_up(self):
+        """Return True if the router reports the WAN interface up with an address, None if it cannot tell."""
+        output = self._execute_command(f"ifstatus {self.interface}")
+        if not output:
+            return None  # No answer, e.g. while the network restart drops the link
+        try:
+            status = json.loads(output)
+        except ValueError:
+            return None
+        return bool(status.get("up") and status.get("ipv4-address"))
+
+    def _wait_for_new_ip(self, old_ip):
+        """Poll the WAN state and the public IP with exponential backoff until the IP differs from old_ip."""
+        delay = self.poll_initial
+        deadline = time.monotonic() + self.ready_timeout
+        new_ip = None
+        while time.monotonic() < deadline:
+            time.sleep(min(delay, max(0, deadline - time.monotonic())))
+            delay = min(delay * 2, self.poll_max)
+            if self._wan_is_up() is False:
+                continue  # Lease not there yet, no point asking for the public IP
+            new_ip = self._get_public_ip(quiet=True) or new_ip
+            if new_ip and new_ip != old_ip:
+                break
+        return new_ip
+
     def get_current_ip_age(self):
         """Return the age (in days) of the current public IP, or None if not found."""
         try:
@@ -183,19 +276,26 @@ class ChangeFiberIP:
                 return None
 
             ip_date, _ = ip_info
-            today = datetime.strptime(datetime.now().strftime("%Y%m%d"), "%Y%m%d")
-            ip_date_dt = datetime.strptime(str(ip_date), "%Y%m%d")
-            age_days = (today - ip_date_dt).days
+            age_days = (datetime.now().date() - date(ip_date // 10000, ip_date // 100 % 100, ip_date % 100)).days
             print(f"IP {current_ip} is {age_days} days old.")
             return age_days
         except Exception as e:
             print(f"Failed to get IP age: {e}")
             return None
 
-    def change_ip(self):
-        """Change the router's MAC address to get a new IP, ensuring it's not banned or too recent."""
+    def cycle_due(self):
+        """Return True unless a failed cycle asked change_ip to wait before the next one."""
+        return time.time() >= self.next_cycle
+
+    def change_ip(self, ban=False):
+        """Run one cycle of MAC changes to get a new IP that is not banned or too recent; False if it failed.
+
+        With ban, the current IP is marked as banned once the router is reachable, so an IP is never banned
+        by a rotation that could not even start.
+        """
         today_date = int(datetime.now().strftime("%Y%m%d"))
         print(f"Today's date: {today_date}")
+        self._load_addresses()  # Once per rotation; the attempts below only use the cached view
 
         # Get initial public IP
         initial_ip = self._get_public_ip()
@@ -204,71 +304,67 @@ class ChangeFiberIP:
         else:
             print("Could not retrieve initial public IP address.")
 
-        # Connect to the router
-        ssh_client = self._ssh_connect()
-        if not ssh_client:
-            print("Exiting due to connection failure.")
-            return False
+        # Connect to the router, or reuse the connection of an earlier rotation
+        if not self._ssh():
+            print("Router connection failed.")
+            return self._fail_cycle()
+        if ban and initial_ip:
+            self._write_ip(initial_ip, today_date, 1)
+            print(f"IP {initial_ip} marked as banned (status = 1) with date {today_date}.")
+
+        attempt_count = 0
+        while attempt_count < self.max_attempts_per_cycle:
+            attempt_count += 1
+            print(f"Attempt {attempt_count} of {self.max_attempts_per_cycle} in cycle {self.failed_cycles + 1}")
+
+            # Change MAC address
+            if not self._change_mac_address():
+                print("MAC address change failed.")
+                continue
+
+            # Wait until the WAN has a new lease
+            print("Waiting for a new WAN lease...")
+            new_ip = self._wait_for_new_ip(initial_ip)
+            if not new_ip:
+                print("ERROR: Could not retrieve new public IP address.")
+                continue
+
+            print(f"New public IP address: {new_ip}")
+            if new_ip != initial_ip:
+                print("SUCCESS: Public IP address has changed successfully.")
+            else:
+                print("FAIL: Public IP address remains the same.")
 
-        try:
-            cycle_count = 0
-            while cycle_count < self.max_cycles:
-                attempt_count = 0
-                while attempt_count < self.max_attempts_per_cycle:
-                    attempt_count += 1
-                    print(f"Attempt {attempt_count} of {self.max_attempts_per_cycle} in cycle {cycle_count + 1}")
-
-                    # Change MAC address
-                    if not self._change_mac_address(ssh_client):
-                        print("MAC address change failed.")
-                        continue
-
-                    # Wait for network to stabilize
-                    print("Waiting for network to stabilize...")
-                    time.sleep(10)
-
-                    # Get new public IP
-                    new_ip = self._get_public_ip()
-                    if not new_ip:
-                        print("ERROR: Could not retrieve new public IP address.")
-                        continue
-
-                    print(f"New public IP address: {new_ip}")
-                    if new_ip != initial_ip:
-                        print("SUCCESS: Public IP address has changed successfully.")
-                    else:
-                        print("FAIL: Public IP address remains the same.")
-
-                    # Check IP in database
-                    ip_info = self._check_ip_in_db(new_ip)
-                    if ip_info:
-                        # IP exists, update date
-                        self._update_ip_date(new_ip, today_date)
-                        if self._is_ip_invalid(ip_info, today_date):
-                            print(f"IP {new_ip} is invalid. Trying again...")
-                            initial_ip = new_ip  # Update to avoid false success
-                            continue
-                    else:
-                        # New IP, insert into database
-                        self._insert_new_ip(new_ip, today_date)
-
-                    # Valid IP found, return success
-                    print(f"Valid IP {new_ip} obtained.")
-                    return True
-
-                # All attempts in this cycle failed
-                cycle_count += 1
-                if cycle_count < self.max_cycles:
-                    print(f"All attempts in cycle {cycle_count} failed. Waiting {self.retry_wait_seconds} seconds before next cycle...")
-                    time.sleep(self.retry_wait_seconds)
-                else:
-                    print("Max cycles reached. UNABLE to get usable IP.")
-                    sys.exit("UNABLE to get usable IP.")
-
-        finally:
-            ssh_client.close()
-            print("SSH connection closed.")
+            # Check IP in database
+            ip_info = self._check_ip_in_db(new_ip)
+            if ip_info:
+                # IP exists, update date
+                self._update_ip_date(new_ip, today_date)
+                if self._is_ip_invalid(ip_info):
+                    print(f"IP {new_ip} is invalid. Trying again...")
+                    initial_ip = new_ip  # Update to avoid false success
+                    continue
+            else:
+                # New IP, insert into database
+                self._insert_new_ip(new_ip, today_date)
 
+            # Valid IP found, return success
+            print(f"Valid IP {new_ip} obtained.")
+            self.failed_cycles = 0
+            self.next_cycle = 0
+            return True
+
+        return self._fail_cycle()
+
+    def _fail_cycle(self):
+        """Count a failed cycle; the caller retries from next_cycle on instead of waiting here. Returns False."""
+        self.failed_cycles += 1
+        if self.failed_cycles < self.max_cycles:
+            self.next_cycle = time.time() + self.retry_wait_seconds
+            print(f"Cycle {self.failed_cycles} failed. Next cycle in {self.retry_wait_seconds} seconds.")
+        else:
+            print("Max cycles reached. UNABLE to get usable IP.")
+            sys.exit("UNABLE to get usable IP.")
         return False
 
     def set_banned_ip(self):
@@ -280,33 +376,13 @@ class ChangeFiberIP:
                 return False
 
             today_date = int(datetime.now().strftime("%Y%m%d"))
-            ip_info = self._check_ip_in_db(current_ip)
-            if ip_info:
-                # Update existing IP to banned
-                try:
-                    conn = sqlite3.connect(self.sqlite3_file)
-                    cursor = conn.cursor()
-                    cursor.execute(f"UPDATE {self.table} SET status = 1, date = ? WHERE ip = ?", (today_date, current_ip))
-                    conn.commit()
-                    conn.close()
-                    print(f"IP {current_ip} marked as banned (status = 1) with date {today_date}.")
-                    return True
-                except sqlite3.Error as e:
-                    print(f"Failed to update IP status: {e}")
-                    return False
-            else:
-                # Insert new IP as banned
-                try:
-                    conn = sqlite3.connect(self.sqlite3_file)
-                    cursor = conn.cursor()
-                    cursor.execute(f"INSERT INTO {self.table} (ip, date, status) VALUES (?, ?, ?)", (current_ip, today_date, 1))
-                    conn.commit()
-                    conn.close()
-                    print(f"IP {current_ip} inserted as banned (status = 1) with date {today_date}.")
-                    return True
-                except sqlite3.Error as e:
-                    print(f"Failed to insert banned IP: {e}")
-                    return False
+            try:
+                self._write_ip(current_ip, today_date, 1)
+                print(f"IP {current_ip} marked as banned (status = 1) with date {today_date}.")
+                return True
+            except sqlite3.Error as e:
+                print(f"Failed to set IP status: {e}")
+                return False
         except Exception as e:
             print(f"Failed to set banned IP: {e}")
             return False
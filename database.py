@@ -0,0 +1,63 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, Optional
+
+BUSY_TIMEOUT = 60  # Seconds a connection waits for another process to release the write lock
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "9p", "afs", "ceph", "glusterfs")
+
+
+class Database:
+    """Hands out SQLite connections that several processes on one host can use on one file at the same time.
+
+    WAL keeps its index in shared memory next to the file, so it does not work across hosts: every process
+    of a file must run on the machine that stores it. Several machines need a client/server database instead.
+    """
+
+    def __init__(self, sqlite3_file: str, busy_timeout: float = BUSY_TIMEOUT):
+        """Initialize manager; the file is switched to WAL by the first connection that may write."""
+        self.sqlite3_file = sqlite3_file
+        self.busy_timeout = busy_timeout
+        self.local = threading.local()  # One connection per thread and mode, see connection()
+
+    def connect(self, readonly: bool = False, check_same_thread: bool = True) -> sqlite3.Connection:
+        """Open a new connection with WAL, a busy timeout and crash-safe syncing."""
+        if readonly:
+            db = sqlite3.connect(f"file:{self.sqlite3_file}?mode=ro", uri=True, timeout=self.busy_timeout,
+                                 check_same_thread=check_same_thread)
+        else:
+            db = sqlite3.connect(self.sqlite3_file, timeout=self.busy_timeout, check_same_thread=check_same_thread)
+            # WAL lets readers in other processes run while one writes, and an interrupted commit is rolled
+            # back from the log when the file is next opened; it is a property of the file and persists
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")  # Consistent after a crash, fsync only on checkpoints
+        db.execute(f"PRAGMA busy_timeout={int(self.busy_timeout * 1000)}")
+        return db
+
+    def filesystem(self) -> Optional[str]:
+        """Return the type of the filesystem that holds the file, e.g. "ext4" or "nfs4", None if unknown."""
+        directory = os.path.dirname(os.path.realpath(self.sqlite3_file))
+        try:
+            with open("/proc/mounts") as f:
+                mounts = [(point.replace("\\040", " "), fstype) for _, point, fstype, *_ in map(str.split, f)]
+        except OSError:
+            return None  # Not Linux
+        # The innermost mount point that contains the directory
+        matches = [(point, fstype) for point, fstype in mounts if os.path.commonpath([directory, point]) == point]
+        return max(matches, key=lambda match: len(match[0]))[1] if matches else None
+
+    def is_shared(self) -> bool:
+        """Return True if the file is on a network filesystem, where processes on other hosts break WAL."""
+        return self.filesystem() in NETWORK_FILESYSTEMS
+
+    def connection(self, readonly: bool = False) -> sqlite3.Connection:
+        """Return this thread's shared connection, opening it on first use."""
+        connections: Dict[bool, sqlite3.Connection] = self.local.__dict__.setdefault("connections", {})
+        if readonly not in connections:
+            connections[readonly] = self.connect(readonly)
+        return connections[readonly]
+
+    def close(self) -> None:
+        """Close the connections of this thread; the last one out checkpoints the WAL into the file."""
+        for db in self.local.__dict__.pop("connections", {}).values():
+            db.close()
@@ -5,26 +5,626 @@
 
 import json
 import sys
+import atexit
+import signal
 import os
 import glob
+import shutil
 import time
 import random
+import collections
 import datetime
 import argparse
+import asyncio
 import re
+import threading
+import queue
+import socket
 import music_tag
 import sqlite3
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from typing import List, Dict, Optional, Tuple
 from sanitize_filename import sanitize
 from sty import fg, rs
 from ytmusicapi import YTMusic
-from difflib import SequenceMatcher
 from change_fiber_ip import ChangeFiberIP
+from ytmusic_cache import CachedYTMusic
+from database import Database
+from tagger import tag_fields, write_tags, tag_album, fetch_cover
+from artist_matcher import ArtistMatcher
+from metrics import Metrics
 
 DAILY_LIMIT = 2500
+HOURLY_LIMIT = 300
+IP_LIMIT = 1000  # Per public IP per day
 BATCH_LIMIT = 550
+BATCH_REST = 3600  # Pause of a daemon between batches
 DELAY_SONG = 20
 DELAY_ERROR = 1100
+DELAY_MIN = 5  # Fastest pace the scheduler may reach between downloads
+# Least pause before each retry of a download that failed with a retryable error; the run exits after the last
+RETRY_PAUSES = [0, DELAY_ERROR, 2 * DELAY_ERROR]
+ROTATE_THROTTLES = 3  # Consecutive throttling errors of all workers after which a run changes its public IP
+
+# yt-dlp error text -> error name
+ERROR_PATTERNS = {
+    "Sign in to confirm your age": "AGE ERROR",
+    "Signature extraction failed|msig extraction failed": "SIG EXTRACTION ERROR",
+    "File name too long": "FILENAME TOO LONG ERROR",
+    "The downloaded file is empty": "DOWNLOADED FILE EMPTY",
+    "Join this channel to get access": "SPECIAL CHANNEL ACCESS",
+    "Premieres in": "SPECIAL CHANNEL ACCESS",
+    "Error 403: Forbidden": "FORBIDDEN ERROR",
+    "Error 429|Too Many Requests": "THROTTLED ERROR",
+    "Temporary failure in name resolution": "NAME RESOLUTION ERROR",
+}
+# Errors that are specific to the track; it is skipped without retrying
+SKIP_ERRORS = ["AGE ERROR", "SIG EXTRACTION ERROR", "FILENAME TOO LONG ERROR",
+               "DOWNLOADED FILE EMPTY", "SPECIAL CHANNEL ACCESS"]
+# Errors that mean the server is throttling us
+THROTTLE_ERRORS = ["FORBIDDEN ERROR", "THROTTLED ERROR"]
+COMMIT_ROWS = 500  # Commit batched writes after this many rows...
+COMMIT_SECONDS = 5  # ...or after this many seconds; other processes wait this long at most for the write lock
+INCOMING_MAX_AGE = 86400  # Files left in .incoming this long belong to a killed run
+DURATION_TOLERANCE = 3  # Seconds a file may differ from the track length in the metadata, or 2% if more
+# Verification problems that only a cut-off download leaves behind; other problems keep the file for a look
+TRUNCATED = ["EMPTY FILE", "NO AUDIO", "PARTIAL FILE"]
+AUDIO_EXTENSIONS = (".opus", ".m4a")  # Containers convert() produces, the files --verify checks
+LEASE_SECONDS = 600  # A daemon's claim on a queued artist expires this long after its last heartbeat
+LEASE_HEARTBEAT = 60  # How often a daemon extends the lease of the artist it is working on
+# Status of artists, albums and tracks in the database
+STATUS_CODES = {
+    'PRELOAD': 1, 'NULL': 2, 'IGNORED': 3, 'LIVE': 4,
+    'NOMETADATA': 5, 'INCOMPLETE': 6, 'FINISHED': 9
+}
+
+class DownloadEngine:
+    """Keeps one yt-dlp session per worker thread alive across all tracks of a run."""
+
+    def __init__(self, incoming_dir: str, container_only: bool = False):
+        """Initialize engine that downloads into incoming_dir before moving files into place."""
+        self.incoming_dir = incoming_dir
+        self.container_only = container_only  # Remux native opus/m4a streams instead of re-encoding
+        self.extensions = AUDIO_EXTENSIONS if container_only else AUDIO_EXTENSIONS[:1]  # What convert() produces
+        self.local = threading.local()
+        self.sessions = []  # All live YoutubeDL instances, for close()
+        self.lock = threading.Lock()
+
+    def _options(self) -> Dict:
+        """Build yt-dlp options; a fixed output template lets one session serve every track."""
+        if self.container_only:
+            # Prefer streams that only need a new container
+            audio_format = 'bestaudio[acodec=opus]/bestaudio[ext=m4a]/bestaudio/best'
+        else:
+            audio_format = 'bestaudio/best'
+        return {
+            'format': audio_format,
+            'outtmpl': os.path.join(self.incoming_dir, '%(id)s.%(ext)s'),
+            'continuedl': True,  # Resume the .part file a killed run left in incoming_dir
+            'quiet': True,
+            'no_warnings': False,
+        }
+
+    def _session(self):
+        """Return this thread's YoutubeDL, building it if missing or if the options changed."""
+        import yt_dlp
+        opts = self._options()
+        if getattr(self.local, "ydl", None) is None or self.local.opts != opts:
+            self.reset()
+            ydl = yt_dlp.YoutubeDL(opts)
+            self.local.ydl, self.local.opts = ydl, opts
+            with self.lock:
+                self.sessions.append(ydl)
+        return self.local.ydl
+
+    def reset(self) -> None:
+        """Drop this thread's session so the next download builds a fresh one."""
+        ydl = getattr(self.local, "ydl", None)
+        if ydl is None:
+            return
+        self.local.ydl = None
+        with self.lock:
+            if ydl in self.sessions:
+                self.sessions.remove(ydl)
+        ydl.close()
+
+    def close(self) -> None:
+        """Close every session opened by any thread."""
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for ydl in sessions:
+            ydl.close()
+
+    def clean(self, max_age: float = INCOMING_MAX_AGE) -> int:
+        """Delete files that a killed run left behind in incoming_dir; returns how many were removed."""
+        removed = 0
+        try:
+            entries = list(os.scandir(self.incoming_dir))
+        except FileNotFoundError:
+            return 0
+        for entry in entries:
+            try:
+                if entry.is_file() and time.time() - entry.stat().st_mtime > max_age:
+                    os.remove(entry.path)
+                    removed += 1
+            except FileNotFoundError:
+                pass  # Moved into place by another process meanwhile
+        return removed
+
+    def fetch(self, song_id: str) -> Dict:
+        """Network stage: download the raw audio stream of song_id, returning its info dict."""
+        os.makedirs(self.incoming_dir, exist_ok=True)
+        try:
+            info = (self._session().extract_info(song_id, download=True).get("requested_downloads") or [{}])[0]
+        except BaseException:
+            self.reset()  # Rebuild after any error, the session state may be stale
+            raise
+        if not info.get("filepath") or not os.path.exists(info["filepath"]):
+            matches = [f for f in glob.glob(os.path.join(glob.escape(self.incoming_dir), f"{glob.escape(song_id)}.*"))
+                       if not f.endswith(".part")]
+            if not matches:
+                raise FileNotFoundError(f"yt-dlp output for {song_id} not found")
+            info["filepath"], info["ext"] = matches[0], os.path.splitext(matches[0])[1][1:]
+        return info
+
+    def _extract_audio(self, info: Dict, codec: str) -> Dict:
+        """Run yt-dlp's FFmpegExtractAudio on a downloaded file, removing the source afterwards."""
+        from yt_dlp.postprocessor import FFmpegExtractAudioPP
+        pp = FFmpegExtractAudioPP(self._session(), preferredcodec=codec, preferredquality='0')  # 0 ensures the best quality for opus
+        files_to_delete, info = pp.run(info)
+        for filename in files_to_delete:
+            if filename != info["filepath"] and os.path.exists(filename):
+                os.remove(filename)
+        return info
+
+    def convert(self, info: Dict, target: str) -> str:
+        """CPU stage: convert a fetched file with ffmpeg and move it to target plus extension."""
+        if self.container_only:
+            # 'best' makes ffmpeg copy the stream; only re-encode if it is neither opus nor AAC
+            info = self._extract_audio(info, 'best')
+            if info.get("ext") not in ("opus", "m4a"):
+                info = self._extract_audio(info, 'opus')
+        else:
+            info = self._extract_audio(info, 'opus')
+        destination = target + os.path.splitext(info["filepath"])[1]
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        # Across file systems move copies; a killed copy must not leave a truncated file under the final name
+        shutil.move(info["filepath"], destination + ".part")
+        os.replace(destination + ".part", destination)
+        return destination
+
+# Schema version N is reached by applying the first N scripts; only ever append to this list.
+SCHEMA_MIGRATIONS = [
+    # 1: base tables, as originally created
+    """
+    CREATE TABLE IF NOT EXISTS artists (id INTEGER PRIMARY KEY, artist TEXT, status INTEGER);
+    CREATE TABLE IF NOT EXISTS albums (id INTEGER PRIMARY KEY, artist_id INTEGER, album TEXT, status INTEGER);
+    CREATE TABLE IF NOT EXISTS tracks (id INTEGER PRIMARY KEY, album_id INTEGER, track TEXT, status INTEGER);
+    CREATE TABLE IF NOT EXISTS errors (code TEXT, message TEXT);
+    CREATE TABLE IF NOT EXISTS queue (artist TEXT, done INTEGER DEFAULT 0, suggest TEXT);
+    CREATE TABLE IF NOT EXISTS count (date INTEGER PRIMARY KEY, songs INTEGER);
+    """,
+    # 2: unique lookup keys; keep the oldest row of any duplicates, which is the one lookups used to find,
+    # except that a re-queued artist keeps its oldest pending queue row
+    """
+    DELETE FROM artists WHERE id NOT IN (SELECT MIN(id) FROM artists GROUP BY artist);
+    DELETE FROM albums WHERE id NOT IN (SELECT MIN(id) FROM albums GROUP BY artist_id, album);
+    DELETE FROM tracks WHERE id NOT IN (SELECT MIN(id) FROM tracks GROUP BY album_id, track);
+    DELETE FROM queue WHERE rowid NOT IN (
+        SELECT (SELECT rowid FROM queue AS duplicate WHERE duplicate.artist=queued.artist ORDER BY done, rowid LIMIT 1)
+        FROM queue AS queued GROUP BY artist);
+    CREATE UNIQUE INDEX IF NOT EXISTS artists_artist ON artists (artist);
+    CREATE UNIQUE INDEX IF NOT EXISTS albums_artist_album ON albums (artist_id, album);
+    CREATE UNIQUE INDEX IF NOT EXISTS tracks_album_track ON tracks (album_id, track);
+    CREATE UNIQUE INDEX IF NOT EXISTS queue_artist ON queue (artist);
+    """,
+    # 3: queue rows whose albums and tracks were stored by --preload
+    """
+    ALTER TABLE queue ADD COLUMN preloaded INTEGER DEFAULT 0;
+    """,
+    # 4: download counts of the quota budgets other than the daily one in count
+    """
+    CREATE TABLE IF NOT EXISTS quota (bucket TEXT, period INTEGER, songs INTEGER, PRIMARY KEY (bucket, period));
+    """,
+    # 5: indexes behind the aggregates of --status
+    """
+    CREATE INDEX IF NOT EXISTS artists_status ON artists (status);
+    CREATE INDEX IF NOT EXISTS albums_status ON albums (status);
+    CREATE INDEX IF NOT EXISTS tracks_status ON tracks (status);
+    CREATE INDEX IF NOT EXISTS queue_done ON queue (done, preloaded);
+    """,
+    # 6: leases of queued artists, so several daemons can share the queue
+    """
+    ALTER TABLE queue ADD COLUMN worker TEXT;
+    ALTER TABLE queue ADD COLUMN lease REAL;
+    ALTER TABLE queue ADD COLUMN heartbeat REAL;
+    CREATE INDEX IF NOT EXISTS queue_lease ON queue (done, lease);
+    """,
+    # 7: confirmed matches of queued names to YouTube Music artists, keyed by normalized name
+    """
+    CREATE TABLE IF NOT EXISTS aliases (name TEXT PRIMARY KEY, artist TEXT, browse_id TEXT);
+    """,
+]
+
+class TokenBucket:
+    """Thread-safe token bucket: acquire() blocks until a token is available."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        """Initialize bucket refilling rate tokens per second, holding at most capacity tokens."""
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Take tokens from the bucket, sleeping until enough have been refilled."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = (tokens - self.tokens) / self.rate
+            time.sleep(wait)
+
+class WriteBatcher:
+    """Runs database writes in a shared transaction that is committed in batches instead of per row."""
+
+    def __init__(self, db: sqlite3.Connection, max_rows: int = COMMIT_ROWS, max_seconds: float = COMMIT_SECONDS,
+                 metrics: Optional[Metrics] = None):
+        """Initialize batcher; it commits on flush() or after max_rows writes or max_seconds."""
+        self.db = db
+        self.metrics = metrics  # Times the writes and commits
+        self.max_rows = max_rows
+        self.max_seconds = max_seconds
+        self.rows = 0  # Writes not yet committed
+        self.started = 0.0  # Time of the first uncommitted write
+        atexit.register(self.flush)  # Also commits on sys.exit(), SIGINT and SIGTERM
+
+    def execute(self, sql: str, values: Tuple = ()) -> sqlite3.Cursor:
+        """Execute a write inside the current batch; reads on the same connection already see it."""
+        started = time.monotonic()
+        cursor = self.db.execute(sql, values)
+        self._observe("db_write", started)
+        if not self.rows:
+            self.started = time.time()
+        self.rows += 1
+        if self.rows >= self.max_rows or time.time() - self.started >= self.max_seconds:
+            self.flush()
+        return cursor
+
+    def executemany(self, sql: str, rows: List[Tuple]) -> sqlite3.Cursor:
+        """Execute a write for every row inside the current batch."""
+        rows = list(rows)
+        started = time.monotonic()
+        cursor = self.db.executemany(sql, rows)
+        self._observe("db_write", started)
+        if not self.rows:
+            self.started = time.time()
+        self.rows += len(rows)
+        if self.rows >= self.max_rows or time.time() - self.started >= self.max_seconds:
+            self.flush()
+        return cursor
+
+    def remaining(self) -> Optional[float]:
+        """Return seconds until the pending batch is due for a commit, None if nothing is pending."""
+        if not self.rows:
+            return None
+        return max(0.0, self.started + self.max_seconds - time.time())
+
+    def flush(self) -> None:
+        """Commit all pending writes in one transaction."""
+        if self.rows:
+            self.commit()
+
+    def commit(self) -> None:
+        """Commit the open transaction even without batched rows, e.g. after a direct write on the connection."""
+        started = time.monotonic()
+        self.db.commit()
+        self._observe("db_commit", started)
+        self.rows = 0
+
+    def _observe(self, stage: str, started: float) -> None:
+        """Record the time since started under stage, if there are metrics."""
+        if self.metrics:
+            self.metrics.observe("stage_seconds", time.monotonic() - started, stage=stage)
+
+class RateScheduler:
+    """Paces downloads AIMD-style: the interval shrinks while downloads succeed and grows sharply on throttling."""
+
+    def __init__(self, interval: float, min_interval: float = DELAY_MIN, max_interval: float = DELAY_ERROR,
+                 step: float = 1.0, backoff: float = 4.0, window: int = 50, stop: Optional[threading.Event] = None):
+        """Initialize scheduler; interval is the starting average gap between downloads of all workers."""
+        self.stop = stop or threading.Event()  # Cuts waits short when set, see wake()
+        self.start_interval = interval
+        self.interval = interval
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.step = step  # Additive speed-up per healthy download
+        self.backoff = backoff  # Multiplicative slow-down per throttling error
+        self.outcomes = collections.deque(maxlen=window)  # Recent (kind, latency), kind is ok/error/throttled
+        self.throttles = 0  # Consecutive throttling errors
+        self.next_slot = 0.0
+        self.held = False  # While set, waits return at once and downloads are handed back, see hold()
+        self.lock = threading.RLock()  # Reentrant: the SIGTERM handler may wake() while the main thread holds it
+        self.wakeup = threading.Condition(self.lock)
+
+    def wait(self) -> float:
+        """Sleep until the caller's download slot; slots are interval ±50% apart, shared by all workers."""
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval * random.uniform(0.5, 1.5)
+            self.wakeup.wait_for(lambda: self.held or self.stop.is_set() or time.monotonic() >= slot,
+                                 timeout=slot - now)
+        return slot - now
+
+    def hold(self) -> None:
+        """Cut every wait short and keep new ones from sleeping until release(), e.g. while the IP changes."""
+        with self.lock:
+            self.held = True
+            self.wakeup.notify_all()
+
+    def release(self) -> None:
+        """End a hold(); waits sleep until their slots again."""
+        with self.lock:
+            self.held = False
+
+    def wake(self) -> None:
+        """Let sleeping waits re-check stop."""
+        with self.lock:
+            self.wakeup.notify_all()
+
+    def success(self, latency: float) -> None:
+        """Record a download; speed up while recent errors are rare and latency is normal."""
+        with self.lock:
+            latencies = sorted(seconds for kind, seconds in self.outcomes if kind == "ok")
+            self.outcomes.append(("ok", latency))
+            self.throttles = 0
+            errors = sum(1 for kind, _ in self.outcomes if kind != "ok")
+            slow = latencies and latency > 2 * latencies[len(latencies) // 2]
+            if errors / len(self.outcomes) < 0.05 and not slow:
+                self.interval = max(self.min_interval, self.interval - self.step)
+
+    def failure(self, throttled: bool, floor: float = 0) -> int:
+        """Record a failed download and back off, returning the pause imposed on all workers, at least floor."""
+        with self.lock:
+            self.outcomes.append(("throttled" if throttled else "error", 0.0))
+            if throttled:
+                self.throttles += 1
+                self.interval = min(self.max_interval, self.interval * self.backoff)
+                pause = min(self.max_interval, self.interval * self.throttles)
+            else:
+                self.interval = min(self.max_interval, self.interval * 1.5)
+                pause = self.interval
+            pause = max(pause, floor)
+            self.next_slot = max(self.next_slot, time.monotonic() + pause)
+            return int(pause)
+
+    def reset(self) -> None:
+        """Forget the backoff of a throttled IP and start over at the initial interval."""
+        with self.lock:
+            self.outcomes.clear()
+            self.throttles = 0
+            self.interval = self.start_interval
+            self.next_slot = 0.0
+
+class QuotaManager:
+    """Hands out download permits against the daily, hourly, per-IP and batch budgets.
+
+    Counts live in the count (daily) and quota tables, or in the daily .cnt file without a database.
+    A permit is reserved before a download starts and recorded or released when it ends, so downloads
+    in flight never overshoot a budget. Database access happens on the caller's thread; the download
+    pool only ever hands finished permits back to the main thread.
+    """
+
+    def __init__(self, db: Optional[sqlite3.Connection], writer: Optional["WriteBatcher"], wait: bool = False,
+                 daily: int = DAILY_LIMIT, hourly: int = HOURLY_LIMIT, per_ip: int = IP_LIMIT,
+                 batch: int = BATCH_LIMIT, batch_rest: int = BATCH_REST, stop: Optional[threading.Event] = None):
+        """Initialize quota; with wait, exhausted budgets sleep until they refill instead of exiting."""
+        self.stop = stop or threading.Event()  # Cuts the refill sleep short when set
+        self.db = db
+        self.writer = writer
+        self.wait_for_refill = wait
+        self.limits = {"DAILY": daily, "HOURLY": hourly, "IP": per_ip, "BATCH": batch}
+        self.batch_rest = batch_rest
+        self.ip = None  # Current public IP for the per-IP budget, unknown until set
+        self.node = None  # Host whose daily budget is used when several daemons share the database
+        self.rotate = None  # Callable that moves to a new public IP, True on success; replaces waiting for IP
+        self.reserved = 0  # Permits handed out but not yet recorded or released
+        self.batch_used = 0
+        self.memory = collections.Counter()  # Hourly and per-IP counts when running without database
+        self.lock = threading.Lock()
+
+    def _used(self, bucket: str, period: int) -> int:
+        """Return the number of downloads counted for a budget in the given period."""
+        if bucket == "day":
+            if self.db:
+                return self._db_count("SELECT songs FROM count WHERE date=?", (period,))
+            try:
+                with open(datetime.datetime.strptime(str(period), "%Y%m%d").strftime("%Y-%m-%d.cnt")) as f:
+                    return int(f.read() or 0)
+            except (FileNotFoundError, ValueError):
+                return 0
+        if self.db:
+            return self._db_count("SELECT songs FROM quota WHERE bucket=? AND period=?", (bucket, period))
+        return self.memory[(bucket, period)]
+
+    def _db_count(self, sql: str, values: Tuple) -> int:
+        """Return a single count from the database, 0 if there is no row."""
+        result = self.db.execute(sql, values).fetchone()
+        return result[0] if result else 0
+
+    def _add(self, bucket: str, period: int) -> None:
+        """Count one download for a budget in the given period."""
+        if bucket == "day":
+            if self.db:
+                self.writer.execute("INSERT INTO count VALUES(?, 1) ON CONFLICT(date) DO UPDATE SET songs=songs+1",
+                                    (period,))
+            else:
+                count = self._used(bucket, period) + 1
+                with open(datetime.datetime.strptime(str(period), "%Y%m%d").strftime("%Y-%m-%d.cnt"), "w") as f:
+                    f.write(str(count))
+        elif self.db:
+            self.writer.execute("INSERT INTO quota VALUES(?, ?, 1) ON CONFLICT(bucket, period) DO UPDATE SET songs=songs+1",
+                                (bucket, period))
+        else:
+            self.memory[(bucket, period)] += 1
+
+    def _budgets(self) -> List[Tuple[str, int, int, float]]:
+        """Return (name, used, limit, refill time) for every active budget."""
+        now = datetime.datetime.now()
+        day, hour = int(now.strftime("%Y%m%d")), int(now.strftime("%Y%m%d%H"))
+        midnight = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time()).timestamp()
+        next_hour = (now.replace(minute=0, second=0, microsecond=0) + datetime.timedelta(hours=1)).timestamp()
+        budgets = []
+        if self.limits["DAILY"]:
+            used = self._used(f"day:{self.node}", day) if self.node else self._used("day", day)
+            budgets.append(("DAILY", used, self.limits["DAILY"], midnight))
+        if self.limits["HOURLY"]:
+            budgets.append(("HOURLY", self._used("hour", hour), self.limits["HOURLY"], next_hour))
+        if self.limits["IP"] and self.ip:
+            budgets.append(("IP", self._used(f"ip:{self.ip}", day), self.limits["IP"], midnight))
+        if self.limits["BATCH"]:
+            budgets.append(("BATCH", self.batch_used, self.limits["BATCH"], time.time() + self.batch_rest))
+        return budgets
+
+    def acquire(self) -> bool:
+        """Reserve a permit for one download; False if a budget has no permit left."""
+        with self.lock:
+            if any(used + self.reserved >= limit for _, used, limit, _ in self._budgets()):
+                return False
+            self.reserved += 1
+            return True
+
+    def record(self) -> None:
+        """Count a completed download against every budget and return its permit."""
+        now = datetime.datetime.now()
+        day = int(now.strftime("%Y%m%d"))
+        with self.lock:
+            self._add("day", day)
+            if self.node:
+                self._add(f"day:{self.node}", day)
+            self._add("hour", int(now.strftime("%Y%m%d%H")))
+            if self.ip:
+                self._add(f"ip:{self.ip}", day)
+            self.batch_used += 1
+            self.reserved -= 1
+
+    def release(self) -> None:
+        """Return the permit of a download that was not counted."""
+        with self.lock:
+            self.reserved -= 1
+
+    def wait(self) -> None:
+        """Handle exhausted budgets with no downloads in flight: exit, or sleep until they refill."""
+        exhausted = [(name, limit, refill) for name, used, limit, refill in self._budgets() if used >= limit]
+        if not exhausted:
+            return
+        if self.rotate and all(name == "IP" for name, _, _ in exhausted):
+            print(f"\n{fg.li_blue}===== IP LIMIT REACHED: {self.limits['IP']} on {self.ip}, changing IP ====={fg.rs}")
+            if self.rotate():
+                return
+        for name, limit, _ in exhausted:
+            print(f"\n{fg.red}===== {name} LIMIT REACHED: {limit} ====={fg.rs}")
+        if not self.wait_for_refill:
+            sys.exit()
+        refill = max(refill for _, _, refill in exhausted)
+        print(f"Sleeping until {time.strftime('%H:%M:%S', time.localtime(refill))}")
+        if self.writer:
+            self.writer.flush()
+        if self.stop.wait(max(0, refill - time.time())):
+            return
+        if any(name == "BATCH" for name, _, _ in exhausted):
+            self.batch_used = 0
+
+    def check(self) -> None:
+        """Block (or exit) until a permit is available, without keeping it."""
+        while not self.acquire():
+            self.wait()
+        self.release()
+
+class StatusReport:
+    """Read-only progress dashboard of the database, safe to run next to a working daemon."""
+
+    def __init__(self, sqlite3_file: str):
+        """Initialize report; the database is opened read-only and never locked for writing."""
+        if not os.path.exists(sqlite3_file):
+            sys.exit(f"ERROR: {sqlite3_file} not found.")
+        self.db = Database(sqlite3_file).connect(readonly=True)
+        # The report reads columns of every migration and may not migrate a read-only database itself
+        version = self.db.execute("PRAGMA user_version").fetchone()[0]
+        if version < len(SCHEMA_MIGRATIONS):
+            sys.exit(f"ERROR: {sqlite3_file} has schema version {version} of {len(SCHEMA_MIGRATIONS)}; "
+                     f"run the downloader once to upgrade it.")
+        self.status_names = {v: k for k, v in STATUS_CODES.items()}
+
+    def _fetch(self, sql: str, values: Tuple = ()) -> int:
+        """Return a single value from the database, 0 if there is none."""
+        result = self.db.execute(sql, values).fetchone()
+        return (result[0] or 0) if result else 0
+
+    def _by_status(self, table: str) -> Dict[int, int]:
+        """Return {status: rows} of a table, counted on its status index."""
+        return dict(self.db.execute(f"SELECT status, COUNT(*) FROM {table} GROUP BY status").fetchall())
+
+    def _format_counts(self, counts: Dict[int, int]) -> str:
+        """Format {status: rows} as NAME=rows pairs in status order."""
+        return ", ".join(f"{self.status_names.get(status, status)}={rows}"
+                         for status, rows in sorted(counts.items(), key=lambda item: (item[0] is None, item[0] or 0)))
+
+    def show(self) -> None:
+        """Print queue depth, status counts, today's downloads, throughput and the ETA of the queue."""
+        now = datetime.datetime.now()
+        day, hour = int(now.strftime("%Y%m%d")), int(now.strftime("%Y%m%d%H"))
+        last_hour = int((now - datetime.timedelta(hours=1)).strftime("%Y%m%d%H"))
+        week_ago = int((now - datetime.timedelta(days=7)).strftime("%Y%m%d"))
+
+        queued = self._fetch("SELECT COUNT(*) FROM queue WHERE done=0")
+        preloaded = self._fetch("SELECT COUNT(*) FROM queue WHERE done=0 AND preloaded=1")
+        artists, albums, tracks = (self._by_status(table) for table in ("artists", "albums", "tracks"))
+        today = self._fetch("SELECT songs FROM count WHERE date=?", (day,))
+        this_hour = self._fetch("SELECT songs FROM quota WHERE bucket='hour' AND period=?", (hour,))
+        previous_hour = self._fetch("SELECT songs FROM quota WHERE bucket='hour' AND period=?", (last_hour,))
+        week = self.db.execute("SELECT COUNT(*), SUM(songs) FROM count WHERE date>? AND date<?", (week_ago, day)).fetchone()
+        per_day = int(week[1] / week[0]) if week[0] else today
+        # Daily counts of the hosts when several daemons share the database; each has its own DAILY_LIMIT
+        nodes = self.db.execute("SELECT SUBSTR(bucket, 5), songs FROM quota WHERE bucket LIKE 'day:%' AND period=?",
+                                (day,)).fetchall()
+        limit = DAILY_LIMIT * max(1, len(nodes))
+
+        # Tracks still to download: known tracks not finished yet, plus an estimate for artists not crawled yet
+        finished = artists.get(STATUS_CODES['FINISHED'], 0)
+        per_artist = sum(tracks.values()) / finished if finished else 0
+        pending = (tracks.get(STATUS_CODES['PRELOAD'], 0) + tracks.get(STATUS_CODES['INCOMPLETE'], 0)
+                   + int((queued - preloaded) * per_artist))
+
+        print(f"{fg.li_blue}QUEUE{fg.rs}      {queued} artists waiting, {preloaded} preloaded")
+        print(f"{fg.li_blue}ARTISTS{fg.rs}    {self._format_counts(artists)}")
+        print(f"{fg.li_blue}ALBUMS{fg.rs}     {self._format_counts(albums)}")
+        print(f"{fg.li_blue}TRACKS{fg.rs}     {self._format_counts(tracks)}")
+        color = fg.red if today >= limit else fg.green
+        print(f"{fg.li_blue}TODAY{fg.rs}      {color}{today}{fg.rs} / {limit} tracks")
+        for node, songs in nodes:
+            color = fg.red if songs >= DAILY_LIMIT else fg.green
+            print(f"           {node}: {color}{songs}{fg.rs} / {DAILY_LIMIT}")
+        for worker, artist, heartbeat in self.db.execute(
+                "SELECT worker, artist, heartbeat FROM queue WHERE done=0 AND lease>? AND heartbeat IS NOT NULL "
+                "ORDER BY worker", (time.time(),)).fetchall():
+            print(f"{fg.li_blue}WORKER{fg.rs}     {worker}: {artist} (heartbeat {int(time.time() - heartbeat)}s ago)")
+        print(f"{fg.li_blue}THROUGHPUT{fg.rs} {this_hour} tracks this hour, {previous_hour} last hour, "
+              f"{per_day} tracks/day over the last {week[0] or 1} days")
+        rate = (min(per_day, limit) if limit else per_day) or limit  # A limit of 0 means no daily cap
+        if rate:
+            days = pending / rate
+            print(f"{fg.li_blue}ETA{fg.rs}        ~{pending} tracks left, {days:.1f} days at {rate} tracks/day "
+                  f"({(now + datetime.timedelta(days=days)).strftime('%Y-%m-%d')})")
+        else:
+            print(f"{fg.li_blue}ETA{fg.rs}        ~{pending} tracks left, no downloads yet to estimate from")
+        self.db.close()
 
 class DiscographyDownloader:
     """Manages downloading and organizing music discographies from YouTube Music."""
@@ -32,8 +632,16 @@ class DiscographyDownloader:
     def __init__(self, args: argparse.Namespace):
         """Initialize downloader with arguments and setup database."""
         self.args = args
-        self.ytm = YTMusic("auth.json")
+        self.metrics = Metrics()  # Time per stage, API call and cache counts, bytes and track outcomes
+        self.ytm = CachedYTMusic(YTMusic("auth.json"), "metadata_cache.sq3", refresh=args.refresh_metadata)
+        self.ytm.metrics = self.metrics
         self.db = self._open_database() if not args.no_database else None
+        self.writer = WriteBatcher(self.db, metrics=self.metrics) if self.db else None
+        self.matcher = ArtistMatcher(self.db, self.writer)
+        self.fiber = None  # ChangeFiberIP, when this run rotates its public IP
+        self.stop = threading.Event()  # Set by SIGTERM in daemon mode: finish what is in flight, start nothing new
+        self.quota = QuotaManager(self.db, self.writer, wait=args.daemon, batch=BATCH_LIMIT,  # --batch_limit rebinds it
+                                  stop=self.stop)
         self.count_total = 0  # Total tracks processed
         self.album_count = 0  # Total albums processed
         self.current_artist_idx = 0  # Current artist index
@@ -41,77 +649,63 @@ class DiscographyDownloader:
         self.current_album_idx = 0  # Current album index
         self.total_albums = 0  # Total albums per artist
         self.artist_sane = ""  # Sanitized artist name
-        self.status_codes = {
-            'PRELOAD': 1, 'NULL': 2, 'IGNORED': 3, 'LIVE': 4,
-            'NOMETADATA': 5, 'INCOMPLETE': 6, 'FINISHED': 9
-        }
+        self.status_codes = STATUS_CODES
         self.status_names = {v: k for k, v in self.status_codes.items()}
+        self.count_lock = threading.Lock()  # Guards count_total across download workers
+        self.file_index = {}  # Album directory -> {file name without extension: path}, see _dir_index
+        self.index_lock = threading.Lock()
+        self.engine = DownloadEngine(os.path.join(args.output_dir, ".incoming"), args.container_only)
+        # Track pipeline: download pool -> ffmpeg thread -> tagging thread -> main thread
+        self.pool = ThreadPoolExecutor(max_workers=args.workers)
+        self.scheduler = RateScheduler(DELAY_SONG / args.workers, stop=self.stop)
+        self.convert_queue = queue.Queue(maxsize=args.workers)
+        self.tag_queue = queue.Queue(maxsize=args.workers)
+        self.results = queue.Queue()
+        self.cover = (None, None)  # (URL, artwork) of the album the tagging thread is on
+        self.pipeline_depth = args.workers * 3 + 2  # Tracks that fit in the pipeline without blocking
+        threading.Thread(target=self._convert_stage, daemon=True).start()
+        threading.Thread(target=self._tag_stage, daemon=True).start()
+        if args.metrics_file:
+            self.metrics.write_every(args.metrics_file, self.stop)
+        if args.metrics_port:
+            self.metrics.serve(args.metrics_port, args.metrics_host)
 
     def _open_database(self) -> sqlite3.Connection:
-        """Create or open SQLite database and initialize tables."""
+        """Create or open SQLite database and bring its schema up to date."""
         try:
-            db = sqlite3.connect("discography.sq3")
-            db.execute("PRAGMA journal_mode=MEMORY")
+            self.database = Database("discography.sq3")
+            db = self.database.connection()  # The main thread's, closed by self.database.close()
             if not db.execute(
                 "SELECT EXISTS(SELECT 1 FROM sqlite_master WHERE type='table' AND name='artists')"
             ).fetchone()[0]:
-                db.execute("CREATE TABLE artists (id INTEGER PRIMARY KEY, artist TEXT, status INTEGER)")
-                db.execute("CREATE TABLE albums (id INTEGER PRIMARY KEY, artist_id INTEGER, album TEXT, status INTEGER)")
-                db.execute("CREATE TABLE tracks (id INTEGER PRIMARY KEY, album_id INTEGER, track TEXT, status INTEGER)")
-                db.execute("CREATE TABLE errors (code TEXT, message TEXT)")
-                db.execute("CREATE TABLE queue (artist TEXT, done INTEGER DEFAULT 0, suggest TEXT)")
-                db.execute("CREATE TABLE count (date INTEGER PRIMARY KEY, songs INTEGER)")
-                db.commit()
                 self.args.rescan = True
+            self._migrate_database(db)
             return db
         except sqlite3.Error as e:
             self._send_telegram_alert(f"Database error: {e}")
             sys.exit(f"Database error: {e}")
 
-    def _count_file(self, check_only: bool = False) -> int:
-        """Update daily song count in a file."""
-        now = datetime.datetime.now()
-        filename = now.strftime("%Y-%m-%d.cnt")
-        count = 0
-        if not check_only:
+    def _migrate_database(self, db: sqlite3.Connection) -> None:
+        """Apply pending SCHEMA_MIGRATIONS, tracking the schema version in PRAGMA user_version."""
+        version = db.execute("PRAGMA user_version").fetchone()[0]
+        for number, script in enumerate(SCHEMA_MIGRATIONS[version:], version + 1):
             try:
-                with open(filename, "r+") as f:
-                    count = int(f.read() or 0)
-                    count += 1
-                    f.seek(0)
-                    f.write(str(count))
-            except FileNotFoundError:
-                with open(filename, "w") as f:
-                    f.write("1")
-                count = 1
-        if BATCH_LIMIT and self.count_total >= BATCH_LIMIT:
-            print(f"\n{fg.red}===== BATCH LIMIT REACHED: {BATCH_LIMIT} ====={fg.rs}")
-            sys.exit()
-        if DAILY_LIMIT and count >= DAILY_LIMIT:
-            print(f"\n{fg.red}===== DAILY LIMIT REACHED: {DAILY_LIMIT} ====={fg.rs}")
-            sys.exit()
-        return count
-
-    def _count_db(self, check_only: bool = False) -> int:
-        """Update daily song count in database."""
-        now = datetime.datetime.now()
-        today = int(now.strftime("%Y%m%d"))
-        if not check_only:
-            self.db.executescript(
-                f"INSERT INTO count VALUES({today}, 1) ON CONFLICT(date) DO UPDATE SET songs=songs+1;"
-            )
-            self.db.commit()
-        try:
-            count = self.db.execute(f"SELECT songs FROM count WHERE date={today}").fetchone()[0]
-        except (TypeError, IndexError):
-            count = 0
-        if BATCH_LIMIT and self.count_total >= BATCH_LIMIT:
-            print(f"\n{fg.red}===== BATCH LIMIT REACHED: {BATCH_LIMIT} ====={fg.rs}")
-            sys.exit()
-        if DAILY_LIMIT and count >= DAILY_LIMIT:
-            print(f"\n{fg.red}===== DAILY LIMIT REACHED: {DAILY_LIMIT} ====={fg.rs}")
-            sys.exit()
-        return count
+                # Take the write lock before re-reading the version, another process may be migrating too
+                db.execute("BEGIN IMMEDIATE")
+                if db.execute("PRAGMA user_version").fetchone()[0] >= number:
+                    db.rollback()
+                    continue
+                for statement in script.split(";"):
+                    if statement.strip():
+                        db.execute(statement)
+                db.execute(f"PRAGMA user_version={number}")
+                db.commit()
+            except sqlite3.Error:
+                db.rollback()
+                raise
+        # Statements are compiled against this connection's cached schema; reading the schema table
+        # refreshes it in case another process migrated the file meanwhile
+        db.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
 
     def _dump_json(self, data: Dict, filename: str = "temp.json") -> None:
         """Dump JSON data to a file with pretty-printing for debugging."""
@@ -122,14 +716,6 @@ class DiscographyDownloader:
         """Sanitize filename by replacing illegal characters."""
         return sanitize(filename.replace('/', '-').replace('`', "'").replace("º", "°"))
 
-    def _similarity(self, a: str, b: str) -> float:
-        """Calculate similarity between two strings."""
-        return SequenceMatcher(None, a, b).ratio()
-
-    def _delay(self, seconds: int = 10) -> None:
-        """Delay execution with random variation (±50%)."""
-        time.sleep(random.randint(int(seconds / 2), int(seconds * 1.5)))
-
     def _send_telegram_alert(self, message: str) -> None:
         """Stub method to send a Telegram notification for unhandled errors."""
         # TODO: Implement Telegram notification using a library like python-telegram-bot
@@ -161,61 +747,62 @@ class DiscographyDownloader:
         print(f"Skipping {len(skip_ids)} albums numbered: {' '.join(map(str, skip_nums))}...")
         return [album for album in albums if album["browseId"] not in skip_ids]
 
-    def _set_metadata(self, album: Dict, track: Dict, filename: str) -> bool:
-        """Set metadata for a downloaded track, returning True if album and artist are set."""
-        try:
-            tags = music_tag.load_file(filename)
-        except NotImplementedError:
-            return False
-        if tags["album"]:
-            return True  # Already tagged
-
-        success = True
-        incomplete_fields = []
-
-        # Critical fields: album and artist
-        try:
-            tags["album"] = album["title"]
-        except Exception as e:
-            incomplete_fields.append(f"album: {e}")
-            success = False
-
-        try:
-            tags["artist"] = track["artists"][0]["name"] if track.get("artists") and track["artists"][0].get("name") else ""
-        except Exception as e:
-            incomplete_fields.append(f"artist: {e}")
-            success = False
+    def _dir_index(self, path: str) -> Dict[str, str]:
+        """Return a name-without-extension -> file map of a directory's finished tracks, listing it only once.
 
-        # Non-critical fields
-        try:
-            track_year = track.get("year", album.get("year", ""))
-            tags["year"] = "" if track_year in ["Single", "EP"] else track_year
-        except Exception as e:
-            incomplete_fields.append("year")
+        Only the containers convert() produces count; an unconverted .webm or .m4a left by an interrupted
+        run is not a finished track, and the track is downloaded and converted again.
+        """
+        with self.index_lock:
+            index = self.file_index.get(path)
+            if index is None:
+                index = {}
+                try:
+                    with os.scandir(path) as entries:
+                        for entry in entries:
+                            stem, ext = os.path.splitext(entry.name)
+                            if ext in self.engine.extensions and entry.is_file():
+                                index.setdefault(stem, entry.path)
+                except FileNotFoundError:
+                    pass
+                self.file_index[path] = index
+            return index
+
+    def _index_file(self, filename: str) -> None:
+        """Record a newly written file in the index of its directory."""
+        index = self._dir_index(os.path.dirname(filename))
+        with self.index_lock:
+            index[os.path.splitext(os.path.basename(filename))[0]] = filename
+
+    def _existing_file(self, filename: str) -> Optional[str]:
+        """Check if a file exists with any extension."""
+        return self._dir_index(os.path.dirname(filename)).get(os.path.basename(filename))
 
+    def _verify_file(self, filename: str, duration: Optional[int] = None) -> Optional[str]:
+        """Return what is wrong with an audio file, None if it is sound and matches the expected duration."""
         try:
-            tags["tracktitle"] = track.get("title", "")
-        except Exception as e:
-            incomplete_fields.append("tracktitle")
-
+            if not os.path.getsize(filename):
+                return "EMPTY FILE"
+            length = music_tag.load_file(filename)["#length"].value
+        except NotImplementedError:
+            return None  # Format music_tag cannot read, nothing to check
+        except Exception:
+            return "UNREADABLE FILE"
+        if not length:
+            return "NO AUDIO"
+        if duration and abs(length - duration) > max(DURATION_TOLERANCE, duration * 0.02):
+            return f"DURATION MISMATCH {int(length)}s/{duration}s"
+        return None
+
+    def _unindex_file(self, filename: str) -> None:
+        """Delete a file and drop it from the index of its directory."""
         try:
-            tags["tracknumber"] = track.get("trackNumber", 0)
-        except Exception as e:
-            incomplete_fields.append("tracknumber")
-
-        if incomplete_fields:
-            print(f" -- Metadata OK: no {', '.join(incomplete_fields)}", end="")
-        else:
-            print(" -- got metadata", end="")
-
-        if success:
-            tags.save()
-        return success
-
-    def _glob_exists(self, filename: str) -> Optional[str]:
-        """Check if a file exists with any extension."""
-        matches = glob.glob(glob.escape(filename) + ".*")
-        return matches[0] if matches else None
+            os.remove(filename)
+        except FileNotFoundError:
+            pass  # Already gone, e.g. removed by hand during the run
+        index = self._dir_index(os.path.dirname(filename))
+        with self.index_lock:
+            index.pop(os.path.splitext(os.path.basename(filename))[0], None)
 
     def _is_live_album(self, name: str) -> bool:
         """Determine if an album or track is live based on its name."""
@@ -231,40 +818,56 @@ class DiscographyDownloader:
         """Execute SQL query and return single result or scalar."""
         if isinstance(values, str):
             values = (values,)
-        result = self.db.execute(sql, values or ()).fetchone()
+        with self.metrics.timer("stage_seconds", stage="db_query"):
+            result = self.db.execute(sql, values or ()).fetchone()
         return result[0] if result and len(result) == 1 else result
 
+    def _is_done(self, status: int) -> bool:
+        """Check if a database status means the entity needs no more work in this run."""
+        return status in (
+            self.status_codes['FINISHED'],
+            self.status_codes['NOMETADATA'] if self.args.skip_tags else -1,
+            self.status_codes['LIVE'] if not self.args.live else -1,
+            self.status_codes['IGNORED']
+        )
+
+    def _load_tracks(self, album_db_id: int, tracks: List[Dict]) -> Dict[str, Tuple[int, int]]:
+        """Load an album's track rows in one query, adding missing ones in bulk; maps title to (status, id)."""
+        select_sql = "SELECT track, status, id FROM tracks WHERE album_id=?"
+        rows = {track: (status, track_id) for track, status, track_id in self.db.execute(select_sql, (album_db_id,))}
+        missing = [title for title in dict.fromkeys(self._sane_filename(t["title"]) for t in tracks) if title not in rows]
+        if missing:
+            self.writer.executemany("INSERT INTO tracks VALUES(NULL, ?, ?, 1) ON CONFLICT(album_id, track) DO NOTHING",
+                                    [(album_db_id, title) for title in missing])
+            rows = {track: (status, track_id) for track, status, track_id in self.db.execute(select_sql, (album_db_id,))}
+        return rows
+
     def _db_check_status(self, entity_type: str, name: str, parent_id: Optional[int] = None) -> int:
         """Check or insert status for artist, album, or track in database."""
         if entity_type == "artist":
             table, field, parent_field = "artists", "artist", None
             values = (name,)
             sql = "SELECT status, id FROM artists WHERE artist=?"
-            insert_sql = "INSERT INTO artists VALUES(NULL, ?, 1)"
+            insert_sql = "INSERT INTO artists VALUES(NULL, ?, 1) ON CONFLICT(artist) DO NOTHING"
             display = f"{self.current_artist_idx}/{self.total_artists}: {self.artist_sane} {fg.li_blue}"
         elif entity_type == "album":
             table, field, parent_field = "albums", "album", "artist_id"
             values = (parent_id, name)
             sql = f"SELECT status, id FROM albums WHERE {parent_field}=? AND {field}=?"
-            insert_sql = f"INSERT INTO albums VALUES(NULL, ?, ?, 1)"
+            insert_sql = "INSERT INTO albums VALUES(NULL, ?, ?, 1) ON CONFLICT(artist_id, album) DO NOTHING"
             display = f"  {self.current_artist_idx}/{self.total_artists}: {self.artist_sane} -- {self.current_album_idx}/{self.total_albums}: {name} {fg.li_blue}"
         else:  # track
             table, field, parent_field = "tracks", "track", "album_id"
             values = (parent_id, name)
             sql = f"SELECT status, id FROM tracks WHERE {parent_field}=? AND {field}=?"
-            insert_sql = f"INSERT INTO tracks VALUES(NULL, ?, ?, 1)"
+            insert_sql = "INSERT INTO tracks VALUES(NULL, ?, ?, 1) ON CONFLICT(album_id, track) DO NOTHING"
             display = f"    {fg.li_blue}"
 
         result = self._db_fetch(sql, values)
         if result:
             status, entity_id = result
             status_name = self.status_names.get(status, "OTHER")
-            if status in (
-                self.status_codes['FINISHED'],
-                self.status_codes['NOMETADATA'] if self.args.skip_tags else -1,
-                self.status_codes['LIVE'] if not self.args.live else -1,
-                self.status_codes['IGNORED']
-            ):
+            if self._is_done(status):
                 if entity_type != "track":
                     print(f"{display}FINISHED{fg.rs}")
                 return 0
@@ -274,36 +877,22 @@ class DiscographyDownloader:
         else:
             if entity_type != "track":
                 print(f"{display}START{fg.rs}")
-            cursor = self.db.cursor()
-            cursor.execute(insert_sql, values)
-            self.db.commit()
-            return cursor.lastrowid
+            cursor = self.writer.execute(insert_sql, values)
+            # Another writer may have added the row since the lookup
+            return cursor.lastrowid if cursor.rowcount == 1 else self._db_fetch(sql, values)[1]
 
-    def _download_track(self, path: str, song_file: str, song_id: str) -> Tuple[int, str]:
-        """Download a track using yt-dlp."""
+    def _download_track(self, song_id: str) -> Tuple[int, str, Optional[Dict]]:
+        """Fetch a track's audio stream using the shared yt-dlp engine."""
         import yt_dlp
-        os.makedirs(path, exist_ok=True)
-        output_template = os.path.join(path, f"{song_file}.%(ext)s")
-        ydl_opts = {
-            'format': 'bestaudio/best',
-            'extractaudio': True,
-            'outtmpl': output_template,
-            'quiet': True,
-            'no_warnings': False,
-            'postprocessors': [{
-                'key': 'FFmpegExtractAudio',
-                'preferredcodec': 'opus',
-                'preferredquality': '0',  # 0 ensures the best quality for opus
-            }],
-        }
-
-        self.count_total += 1
+        with self.count_lock:
+            self.count_total += 1
         try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                ydl.download([song_id])
-            return 0, ""
+            with self.metrics.timer("stage_seconds", stage="download"):
+                info = self.engine.fetch(song_id)
+            self.metrics.count("bytes_downloaded", os.path.getsize(info["filepath"]))
+            return 0, "", info
         except yt_dlp.DownloadError as e:
-            return 1, str(e)
+            return 1, str(e), None
         except KeyboardInterrupt:
             print()
             sys.exit()
@@ -312,101 +901,308 @@ class DiscographyDownloader:
             self._send_telegram_alert(error_msg)
             sys.exit(error_msg)
 
-    def grab_track(self, album_data: Dict, track_data: Dict, album_path: str, album_db_id: int) -> int:
-        """Process a single track."""
+    def _prepare_track(self, album_data: Dict, track_data: Dict, album_path: str, album_db_id: int,
+                       known: Dict[str, Tuple[int, int]]) -> Optional[Dict]:
+        """Resolve file names and database row for a track, or None if it is already done."""
         song_title = track_data["title"]
-        song_id = track_data.get("videoId")
         song_sane = self._sane_filename(song_title)
         # Use trackNumber if not None; otherwise, omit prefix
         track_number = track_data.get("trackNumber")
         song_file = f"{track_number} - {song_sane}" if track_number is not None else song_sane
-        track_status = self.status_codes['INCOMPLETE']
+        track_db_id = None
 
         if self.db:
-            track_db_id = self._db_check_status("track", song_sane, album_db_id)
-            if not track_db_id:
-                return self.status_codes['FINISHED']
+            status, track_db_id = known[song_sane]
+            if self._is_done(status):
+                return None
 
-        skip_delay = False
         song_filename = os.path.join(album_path, song_file)
-        if existing_file := self._glob_exists(song_filename):
-            print(f"    {fg.li_blue}SKIPPED{fg.rs}", end="")
-            skip_delay = True
-
-        elif song_id:
-            return_code, stderr = self._download_track(album_path, song_file, song_id)
-            skip_error = False
-            error_text = ""
-            errors = 0  # Track download errors for this track
-
-            if return_code == 1:
-                error_patterns = {
-                    "Sign in to confirm your age": "AGE ERROR",
-                    "Signature extraction failed|msig extraction failed": "SIG EXTRACTION ERROR",
-                    "File name too long": "FILENAME TOO LONG ERROR",
-                    "The downloaded file is empty": "DOWNLOADED FILE EMPTY",
-                    "Join this channel to get access": "SPECIAL CHANNEL ACCESS",
-                    "Premieres in": "SPECIAL CHANNEL ACCESS",
-                    "Error 403: Forbidden": "FORBIDDEN ERROR",
-                    "Temporary failure in name resolution": "NAME RESOLUTION ERROR",
-                }
-                for pattern, message in error_patterns.items():
-                    if re.search(pattern, stderr, re.I):
-                        skip_error = message in [
-                            "AGE ERROR", "SIG EXTRACTION ERROR", "FILENAME TOO LONG ERROR",
-                            "DOWNLOADED FILE EMPTY", "SPECIAL CHANNEL ACCESS"
-                        ]
-                        error_text = message
+        existing = self._existing_file(song_filename)
+        if existing:
+            problem = self._verify_file(existing, track_data.get("duration_seconds"))
+            if problem in TRUNCATED:
+                # Cut off by a killed run: download it again
+                print(f"    {fg.red}{problem}{fg.rs} - {os.path.basename(existing)}")
+                self._write_error(f'{problem}: "{existing}" removed for download')
+                self._unindex_file(existing)
+                existing = problem = None
+            elif problem:
+                self._write_error(f'{problem}: "{existing}" kept, check it')
+        else:
+            problem = None
+        return {
+            "album": album_data,
+            "track": track_data,
+            "album_db_id": album_db_id,
+            "path": album_path,
+            "file": song_file,
+            "filename": song_filename,
+            "display": song_sane if track_number is None else f"{track_number} - {song_sane}",
+            "db_id": track_db_id,
+            "existing": existing,
+            "problem": problem,
+        }
+
+    def _fetch_track(self, job: Dict) -> Tuple[int, str, bool, Optional[Dict]]:
+        """Download a prepared track, returning (status, output line, counted, yt-dlp info)."""
+        song_file = job["file"]
+        song_id = job["track"].get("videoId")
+
+        if job["existing"] and job["problem"]:
+            return (self.status_codes['INCOMPLETE'],
+                    f"    {fg.red}{job['problem']}{fg.rs} - {job['display']} kept", False, None)
+        if job["existing"]:
+            # Downloaded and verified earlier; the --tag pass tags it
+            return self.status_codes['NOMETADATA'], f"    {fg.li_blue}SKIPPED{fg.rs}", False, None
+
+        if not song_id:
+            return self.status_codes['NULL'], f"    {fg.red}NULL{fg.rs} - {job['display']}", False, None
+
+        started = time.monotonic()
+        return_code, stderr, info = self._download_track(song_id)
+        skip_error = False
+        error_text = ""
+
+        if return_code == 1:
+            for pattern, message in ERROR_PATTERNS.items():
+                if re.search(pattern, stderr, re.I):
+                    skip_error = message in SKIP_ERRORS
+                    error_text = message
+                    break
+            else:
+                error_text = f"OTHER ERROR\n{stderr}"
+                self._send_telegram_alert(f"Unhandled yt-dlp error for {song_file}: {error_text}")
+            self.metrics.count("download_errors", error=error_text.split("\n")[0])
+
+            if not skip_error:
+                throttled = error_text in THROTTLE_ERRORS
+                self._write_error(error_text)
+                # Retry with escalating pauses: a blip passes at the scheduler's pace, an outage or a ban
+                # gets the long waits before the run gives up
+                for floor in RETRY_PAUSES:
+                    pause = self.scheduler.failure(throttled, floor)
+                    if throttled and self.fiber and self.scheduler.throttles >= ROTATE_THROTTLES:
+                        return self._defer_track(job, error_text)
+                    print(f"{fg.red}{error_text}{fg.rs} -- wait {pause}s and try again")
+                    with self.metrics.timer("stage_seconds", stage="delay"):
+                        self.scheduler.wait()
+                    if self.scheduler.held:
+                        return self._defer_track(job, error_text)
+                    if self.stop.is_set():
+                        return (self.status_codes['INCOMPLETE'],
+                                f"    {fg.li_blue}STOPPED{fg.rs} - {job['display']}", False, None)
+                    started = time.monotonic()
+                    return_code, stderr, info = self._download_track(song_id)
+                    if return_code != 1:
                         break
+                    if throttled and self.fiber:
+                        return self._defer_track(job, error_text)
                 else:
-                    error_text = f"OTHER ERROR\n{stderr}"
-                    self._send_telegram_alert(f"Unhandled yt-dlp error for {song_file}: {error_text}")
-
-                if not skip_error:
-                    print(f"{fg.red}{error_text}{fg.rs} -- wait {DELAY_ERROR}s and try again")
-                    self._write_error(error_text)
-                    self._delay(DELAY_ERROR)
-                    return_code, stderr = self._download_track(album_path, song_file, song_id)
-                    if return_code == 1:
-                        print(f"{fg.red}{error_text}{fg.rs} FAIL !!!")
-                        errors += 1
-                        self._send_telegram_alert(f"Persistent yt-dlp error for {song_file}: {error_text}")
-                        sys.exit()
-
-                if errors >= 3:
-                    error_msg = "STOP == too many errors!"
-                    self._send_telegram_alert(error_msg)
-                    print(error_msg)
+                    print(f"{fg.red}{error_text}{fg.rs} FAIL !!!")
+                    self._send_telegram_alert(f"Persistent yt-dlp error for {song_file}: {error_text}")
                     sys.exit()
 
-            if return_code != 0:
-                print(f"    {fg.red}FAIL{fg.rs} - {song_file} - {fg.red}{error_text}{fg.rs}", end="")
-                self._write_error(f'FAIL: "{song_file}" was unable to download')
-                track_status = self.status_codes['INCOMPLETE']
+        if return_code != 0:
+            self._write_error(f'FAIL: "{song_file}" was unable to download')
+            return (self.status_codes['INCOMPLETE'],
+                    f"    {fg.red}FAIL{fg.rs} - {song_file} - {fg.red}{error_text}{fg.rs}", False, None)
+        self.scheduler.success(time.monotonic() - started)
+        return self.status_codes['NOMETADATA'], f"    {fg.green}GOOD{fg.rs} - {job['display']}", True, info
+
+    def _defer_track(self, job: Dict, error_text: str) -> Tuple[int, str, bool, None]:
+        """Pool worker: pause all downloads and hand a throttled track back to be retried on a new IP."""
+        self.scheduler.hold()
+        job["rotate"] = True
+        return self.status_codes['INCOMPLETE'], f"    {fg.red}{error_text}{fg.rs} - {job['display']}", False, None
+
+    def _download_stage(self, job: Dict) -> None:
+        """Network stage (pool worker): fetch a track and hand it on to the ffmpeg stage."""
+        try:
+            if not self.scheduler.held:
+                with self.metrics.timer("stage_seconds", stage="delay"):
+                    self.scheduler.wait()  # Cut short by a throttled worker's hold()
+            if self.stop.is_set():
+                job["status"], job["line"], job["counted"], job["info"] = (
+                    self.status_codes['INCOMPLETE'], f"    {fg.li_blue}STOPPED{fg.rs} - {job['display']}", False, None)
+            elif self.scheduler.held:
+                job["rotate"], job["info"] = True, None  # Not started, retried once the IP has changed
             else:
-                # Adjust output to omit track number if None
-                display_file = song_sane if track_number is None else f"{track_number} - {song_sane}"
-                print(f"    {fg.green}GOOD{fg.rs} - {display_file}", end="")
-                track_status = self.status_codes['NOMETADATA']
-                self._count_db() if self.db else self._count_file()
-
-            if not self.args.skip_tags and (existing_file := self._glob_exists(song_filename)):
-                if self._set_metadata(album_data, track_data, existing_file):
-                    track_status = self.status_codes['FINISHED']
-        else:
-            # Adjust output for NULL case
-            display_file = song_sane if track_number is None else f"{track_number} - {song_sane}"
-            print(f"    {fg.red}NULL{fg.rs} - {display_file}", end="")
-            track_status = self.status_codes['NULL']
+                job["status"], job["line"], job["counted"], job["info"] = self._fetch_track(job)
+            (self.convert_queue if job["info"] else self.results).put(job)
+        except BaseException as e:
+            job["error"] = e
+            self.results.put(job)
+
+    def _convert_stage(self) -> None:
+        """CPU stage thread: run ffmpeg on fetched tracks and hand them on to the tagging stage."""
+        while True:
+            job = self.convert_queue.get()
+            try:
+                if self._convert_job(job):
+                    self.tag_queue.put(job)
+                    continue
+            except BaseException as e:
+                # The thread must survive, or the main thread waits for this track forever
+                job["error"] = e
+            self.results.put(job)
+
+    def _convert_job(self, job: Dict) -> bool:
+        """Convert a fetched track into its album directory; False if ffmpeg failed."""
+        try:
+            with self.metrics.timer("stage_seconds", stage="ffmpeg"):
+                job["file_path"] = self.engine.convert(job["info"], job["filename"])
+        except Exception as e:
+            job["status"] = self.status_codes['INCOMPLETE']
+            job["line"] = f"    {fg.red}FAIL{fg.rs} - {job['file']} - {fg.red}CONVERSION ERROR{fg.rs}"
+            self._write_error(f'FAIL: "{job["file"]}" was unable to convert: {e}')
+            return False
+        self._index_file(job["file_path"])
+        return True
 
-        print("")  # Newline after track processing
+    def _tag_stage(self) -> None:
+        """I/O stage thread: tag converted tracks and report them back to the main thread."""
+        while True:
+            job = self.tag_queue.get()
+            try:
+                self._tag_job(job)
+            except BaseException as e:
+                # The thread must survive, or the main thread waits for this track forever
+                job["error"] = e
+            self.results.put(job)
+
+    def _tag_job(self, job: Dict) -> None:
+        """Verify a converted track and tag it, setting its status and output line."""
+        with self.metrics.timer("stage_seconds", stage="verify"):
+            problem = self._verify_file(job["file_path"], job["track"].get("duration_seconds"))
+        if problem:
+            # Never count a broken download as done; a cut-off one is fetched again by the next run
+            job["status"] = self.status_codes['INCOMPLETE']
+            job["line"] = f"    {fg.red}FAIL{fg.rs} - {job['file']} - {fg.red}{problem}{fg.rs}"
+            if problem in TRUNCATED:
+                self._write_error(f'{problem}: "{job["file_path"]}" failed verification, removed')
+                self._unindex_file(job["file_path"])
+            else:
+                self._write_error(f'{problem}: "{job["file_path"]}" failed verification, kept')
+            return
+        try:
+            if not self.args.skip_tags:
+                with self.metrics.timer("stage_seconds", stage="tag"):
+                    tagged, note = write_tags(job["file_path"], tag_fields(job["album"], job["track"]),
+                                              self._album_cover(job["cover"]))
+                job["line"] += note
+                if tagged:
+                    job["status"] = self.status_codes['FINISHED']
+        except Exception as e:
+            job["line"] += f" -- {fg.red}TAG ERROR{fg.rs}"
+            self._write_error(f'TAG ERROR: "{job["file"]}" {e}')
+
+    def _album_cover(self, url: Optional[str]) -> Optional[bytes]:
+        """Return the artwork of a cover URL, fetched once for all tracks of an album (tagging thread only)."""
+        if url and self.cover[0] != url:
+            self.cover = (url, fetch_cover(url))
+        return self.cover[1] if url else None
+
+    def _finish_track(self, job: Dict) -> int:
+        """Report a processed track, update its status and settle its quota permit (main thread only)."""
+        if "error" in job:
+            raise job["error"]
+        print(job["line"])
+        self.metrics.count("tracks", status=self.status_names[job["status"]])
         if self.db:
-            self.db.execute("UPDATE tracks SET status=? WHERE album_id=? AND id=?", 
-                           (track_status, album_db_id, track_db_id))
-            self.db.commit()
-        if not skip_delay:
-            self._delay(DELAY_SONG)         
-        return track_status
+            self.writer.execute("UPDATE tracks SET status=? WHERE album_id=? AND id=?",
+                           (job["status"], job["album_db_id"], job["db_id"]))
+        if job.get("permit"):
+            self.quota.record() if job["counted"] else self.quota.release()
+        return job["status"]
+
+    def grab_tracks(self, album_data: Dict, tracks: List[Dict], album_path: str, album_db_id: int,
+                    cover_url: Optional[str] = None) -> int:
+        """Process an album's tracks through the download/convert/tag pipeline, returning the album status."""
+        album_status = self.status_codes['FINISHED']
+        pending = 0
+        deferred = []  # Tracks handed back by throttled workers, still pending and holding their permits
+
+        def finish_next() -> int:
+            """Wait for the next track to leave the pipeline and record it."""
+            nonlocal pending
+            while True:
+                if deferred and len(deferred) == pending:
+                    # No download in flight any more: change the IP and retry the tracks from where they were
+                    self._recover_from_throttling()
+                    for job in deferred:
+                        del job["rotate"]
+                        self.pool.submit(self._download_stage, job)
+                    deferred.clear()
+                # Commit a due batch while waiting, an open write transaction blocks other daemons
+                try:
+                    job = self.results.get(timeout=self.writer.remaining() if self.writer else None)
+                except queue.Empty:
+                    self.writer.flush()
+                    continue
+                if "error" not in job and job.get("rotate"):
+                    deferred.append(job)
+                    continue
+                break
+            pending -= 1
+            return self._finish_track(job)
+
+        known = self._load_tracks(album_db_id, tracks) if self.db else {}
+        try:
+            for track_data in tracks:
+                if self.stop.is_set():
+                    album_status = min(album_status, self.status_codes['INCOMPLETE'])
+                    break
+                job = self._prepare_track(album_data, track_data, album_path, album_db_id, known)
+                if job is None:
+                    continue
+                job["cover"] = cover_url
+                if job["existing"] or not job["track"].get("videoId"):
+                    # Nothing to download, no need to occupy a worker
+                    job["status"], job["line"], job["counted"], _ = self._fetch_track(job)
+                    album_status = min(album_status, self._finish_track(job))
+                    continue
+                # Keep the pipeline bounded and never start a download without a quota permit
+                while pending >= self.pipeline_depth:
+                    album_status = min(album_status, finish_next())
+                permit = self.quota.acquire()
+                while not permit and not self.stop.is_set():
+                    if pending:
+                        album_status = min(album_status, finish_next())  # May hand back an unused permit
+                    else:
+                        with self.metrics.timer("stage_seconds", stage="quota_wait"):
+                            self.quota.wait()
+                    permit = self.quota.acquire()
+                if not permit:
+                    album_status = min(album_status, self.status_codes['INCOMPLETE'])
+                    break
+                job["permit"] = True
+                self.pool.submit(self._download_stage, job)
+                pending += 1
+            while pending:
+                album_status = min(album_status, finish_next())
+        except BaseException:
+            # Record the downloads still in flight before giving up, their songs count against the quota
+            self.scheduler.hold()  # Workers hand back the tracks they have not started downloading
+            try:
+                for job in deferred:
+                    if job.get("permit"):
+                        self.quota.release()
+                pending -= len(deferred)
+                while pending:
+                    job = self.results.get()
+                    pending -= 1
+                    if "error" in job:
+                        continue
+                    if job.get("rotate"):
+                        if job.get("permit"):
+                            self.quota.release()
+                        continue
+                    self._finish_track(job)
+            finally:
+                self.scheduler.release()
+                self.pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        return album_status
 
     def grab_album(self, album_data: Dict, artist_db_id: int, artist_name_sane: str) -> int:
         """Process a single album."""
@@ -418,17 +1214,19 @@ class DiscographyDownloader:
 
         if not self.args.live and self._is_live_album(album_sane):
             if self.db:
-                self.db.execute("INSERT INTO albums VALUES(NULL, ?, ?, ?)", 
-                               (artist_db_id, album_sane, self.status_codes['LIVE']))
-                self.db.commit()
+                self.writer.execute("INSERT INTO albums VALUES(NULL, ?, ?, ?) "
+                                    "ON CONFLICT(artist_id, album) DO UPDATE SET status=excluded.status",
+                                    (artist_db_id, album_sane, self.status_codes['LIVE']))
             print(f"  {self.current_artist_idx}/{self.total_artists}: {artist_name_sane} -- "
                   f"{self.current_album_idx}/{self.total_albums}: {album_sane} {fg.li_blue}LIVE{fg.rs}")
             return self.status_codes['LIVE']
 
+        album_db_id = None
         if self.db:
             album_db_id = self._db_check_status("album", album_sane, artist_db_id)
             if not album_db_id:
                 return self.status_codes['FINISHED']
+            self.writer.flush()  # Do not hold the write lock across the API call
 
         try:
             album_info = self.ytm.get_album(album_id)
@@ -439,28 +1237,52 @@ class DiscographyDownloader:
             sys.exit("Mark for retry not implemented")
 
         album_path = os.path.join(self.args.output_dir, artist_name_sane, album_sane)
-        album_status = self.status_codes['FINISHED']
 
         is_live = all(self._is_live_album(self._sane_filename(track["title"])) for track in album_info["tracks"])
         if not self.args.live and is_live:
             if self.db:
-                self.db.execute("UPDATE albums SET status=? WHERE id=?", 
+                self.writer.execute("UPDATE albums SET status=? WHERE id=?", 
                                (self.status_codes['LIVE'], album_db_id))
-                self.db.commit()
             print(f"\033[F  {self.current_artist_idx}/{self.total_artists}: {artist_name_sane} -- "
                   f"{self.current_album_idx}/{self.total_albums}: {album_sane} {fg.li_blue}LIVE{fg.rs}     ")
             return self.status_codes['LIVE']
 
-        for track_data in album_info["tracks"]:
-            track_status = self.grab_track(album_data, track_data, album_path, album_db_id)
-            album_status = min(album_status, track_status)
+        cover_url = (album_info.get("thumbnails") or [{}])[-1].get("url")  # The largest size comes last
+        album_status = self.grab_tracks(album_data, album_info["tracks"], album_path, album_db_id, cover_url)
 
         if self.db:
-            self.db.execute("UPDATE albums SET status=? WHERE artist_id=? AND id=?", 
+            self.writer.execute("UPDATE albums SET status=? WHERE artist_id=? AND id=?", 
                            (album_status, artist_db_id, album_db_id))
-            self.db.commit()
+            self.writer.flush()  # One transaction per album
         return album_status
 
+    def _resolve_singles(self, singles: List[Dict]) -> Dict[str, Optional[str]]:
+        """Fetch the pages of singles not among the artist's songs concurrently at --rate, returning {browseId: videoId}."""
+        def resolve(single: Dict) -> Optional[str]:
+            try:
+                tracks = self.ytm.get_album(single["browseId"]).get("tracks") or []
+            except Exception as e:
+                self._write_error(f"SINGLE FETCH ERROR: {single.get('title')} - {e}")
+                return None
+            # The title track, or the first one if no title matches
+            title = self._sane_filename(single.get("title", ""))
+            track = next((track for track in tracks if self._sane_filename(track.get("title", "")) == title),
+                         tracks[0] if tracks else {})
+            return track.get("videoId")
+
+        if not singles:
+            return {}
+        paced = self.ytm.limiter is None
+        if paced:
+            # The --preload crawler paces its calls already; elsewhere pace these the same way
+            self.ytm.limiter = TokenBucket(self.args.rate).acquire
+        try:
+            with ThreadPoolExecutor(max_workers=min(self.args.concurrency, len(singles))) as pool:
+                return dict(zip((single["browseId"] for single in singles), pool.map(resolve, singles)))
+        finally:
+            if paced:
+                self.ytm.limiter = None
+
     def parse_albums(self, artist_info: Dict, artist_match: str, artist_db_id: int) -> List[Dict]:
         """Parse albums, EPs, singles, and playlist-based albums from artist_info into a unified album list."""
         albums = []
@@ -498,6 +1320,13 @@ class DiscographyDownloader:
 
             # Create virtual "Singles" album
             if single_tracks:
+                # Songs by album id, the first song of an album wins
+                song_ids = {}
+                for song in songs:
+                    song_ids.setdefault((song.get("album") or {}).get("id"), song.get("videoId"))
+                video_ids = {single.get("browseId"): song_ids.get(single.get("browseId")) for single in single_tracks}
+                video_ids.update(self._resolve_singles([single for single in single_tracks
+                                                        if single.get("browseId") and not video_ids[single["browseId"]]]))
                 virtual_album = {
                     "title": "Singles",
                     "browseId": None,
@@ -505,8 +1334,7 @@ class DiscographyDownloader:
                     "tracks": [
                         {
                             "title": single.get("title", ""),
-                            "videoId": next((song.get("videoId") for song in songs 
-                                            if song.get("album", {}).get("id") == single.get("browseId")), None),
+                            "videoId": video_ids.get(single.get("browseId")),
                             "trackNumber": None,  # Singles keep None to avoid numbering
                             "artists": [{"name": artist_match}],
                             "year": single.get("year")
@@ -529,6 +1357,7 @@ class DiscographyDownloader:
                             "title": track.get("title", ""),
                             "videoId": track.get("videoId"),
                             "trackNumber": index + 1,  # Assign sequential track number (1-based)
+                            "duration_seconds": track.get("duration_seconds"),
                             "artists": track.get("artists", [{"name": artist_match}]),
                             "year": album.get("type")
                         } for index, track in enumerate(playlist.get("tracks", []))
@@ -560,61 +1389,70 @@ class DiscographyDownloader:
 
         return processed_albums
     
+    def _match_artist(self, artist_name: str, search_results: List[Dict]) -> Tuple[Optional[Dict], str]:
+        """Pick the search result for artist_name, or return None and the queue suggestion."""
+        artist_info, score = self.matcher.best(artist_name, search_results)
+        if not artist_info:
+            error_msg = f"ERROR: No match for '{artist_name}'"
+            print(f"{fg.red}{error_msg}{fg.rs}")
+            self._write_error(f'BADARTIST: "{artist_name}" no matches')
+            return None, "BAD"
+
+        artist_match = artist_info["artist"]
+        if score < self.matcher.threshold:
+            error_msg = f"Best fit for '{artist_name}' is '{artist_match}': not good enough to continue"
+            print(error_msg)
+            self._write_error(f'BADARTIST: "{artist_name}" best match is "{artist_match}"')
+            return None, artist_match
+        self.matcher.remember(artist_name, artist_info)
+        return artist_info, ""
+
+    def _resolve_artist(self, artist_name: str) -> Tuple[Optional[Dict], str]:
+        """Return the artist_info of a name from the alias table, or search and match it."""
+        artist_info = self.matcher.lookup(artist_name)
+        if artist_info:
+            return artist_info, ""
+        return self._match_artist(artist_name, self.ytm.search(artist_name, filter="artists"))
+
     def grab_discography(self, artist_name: str) -> None:
         """Process an artist's discography."""
         self.current_artist_idx += 1
         self.artist_sane = self._sane_filename(artist_name)
+        self.file_index.clear()  # Directory listings are only kept for the current artist
 
         if self.db:
             status = self._db_fetch("SELECT status FROM artists WHERE artist=?", artist_name)
             if status == self.status_codes['FINISHED']:
-                self.db.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
+                self.writer.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
                 print(f"{self.current_artist_idx}/{self.total_artists}: {artist_name} {fg.li_blue}FINISHED{fg.rs}")
                 return
+            self.writer.flush()  # Do not hold the write lock across the API call
 
         try:
-            search_results = self.ytm.search(artist_name, filter="artists")
+            artist_info, suggest = self._resolve_artist(artist_name)
         except Exception as e:
             error_msg = f"Failed to search artist {artist_name}: {e}"
             self._send_telegram_alert(error_msg)
             self._write_error(error_msg)
             return
 
-        try:
-            artist_info = search_results[0]
-            artist_match = artist_info["artist"]
-        except (IndexError, KeyError):
-            error_msg = f"ERROR: No match for '{artist_name}'"
-            print(f"{fg.red}{error_msg}{fg.rs}")
-            self._write_error(f'BADARTIST: "{artist_name}" no matches')
+        if not artist_info:
             if self.db:
-                self.db.execute("UPDATE queue SET done=1, suggest='BAD' WHERE artist=?", (artist_name,))
-                self.db.commit()
-            return
-
-        similarity = max(
-            self._similarity(artist_name.lower(), artist_match.lower()),
-            self._similarity(f"the {artist_name}".lower(), artist_match.lower())
-        )
-        if similarity < 0.9:
-            error_msg = f"Best fit for '{artist_name}' is '{artist_match}': not good enough to continue"
-            print(error_msg)
-            self._write_error(f'BADARTIST: "{artist_name}" best match is "{artist_match}"')
-            if self.db:
-                self.db.execute("UPDATE queue SET done=1, suggest=? WHERE artist=?", (artist_match, artist_name))
-                self.db.commit()
+                self.writer.execute("UPDATE queue SET done=1, suggest=? WHERE artist=?", (suggest, artist_name))
             return
+        artist_match = artist_info["artist"]
 
         artist_id = artist_info["browseId"]
         self.artist_sane = self._sane_filename(artist_match)
 
+        artist_db_id = None
         if self.db:
             artist_db_id = self._db_check_status("artist", self.artist_sane)
             if not artist_db_id:
+                # The queued name matched an artist that is already done, e.g. "beatles" for "The Beatles"
+                self.writer.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
                 return
-            if self.args.preload:
-                self.db.commit()
-                return
+            self.writer.flush()  # The artist page and parse_albums call the API
 
         try:
             artist_info = self.ytm.get_artist(artist_id)
@@ -632,8 +1470,7 @@ class DiscographyDownloader:
             self._write_error(f'BAD ALBUM: "{artist_match}" has no albums')
             self._dump_json(artist_info, self.artist_sane + ".json")
             if self.db:
-                self.db.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
-                self.db.commit()
+                self.writer.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
             return
 
         if self.args.skip_albums:
@@ -645,53 +1482,411 @@ class DiscographyDownloader:
 
         # Process albums (regular, EPs, and virtual Singles)
         for album_data in albums:
+            if self.stop.is_set():
+                return  # Leave the artist queued, its status is not final
             if album_data["title"] == "Singles" and album_data["browseId"] is None:
                 # Handle virtual Singles album separately
+                album_db_id = None
                 if self.db:
                     album_db_id = self._db_check_status("album", "Singles", artist_db_id)
                     if not album_db_id:
                         continue
                 album_path = os.path.join(self.args.output_dir, self.artist_sane, "Singles")
-                album_status = self.status_codes['FINISHED']
-                for track_data in album_data.get("tracks", []):
-                    track_status = self.grab_track(album_data, track_data, album_path, album_db_id)
-                    album_status = min(album_status, track_status)
+                album_status = self.grab_tracks(album_data, album_data.get("tracks", []), album_path, album_db_id)
                 if self.db:
-                    self.db.execute("UPDATE albums SET status=? WHERE artist_id=? AND id=?", 
+                    self.writer.execute("UPDATE albums SET status=? WHERE artist_id=? AND id=?", 
                                     (album_status, artist_db_id, album_db_id))
-                    self.db.commit()
+                    self.writer.flush()
             else:
                 # Regular albums and EPs
                 album_status = self.grab_album(album_data, artist_db_id, self.artist_sane)
             artist_status = min(artist_status, album_status)
 
         if self.db:
-            self.db.execute("UPDATE artists SET status=? WHERE id=?", (artist_status, artist_db_id))
-            self.db.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
-            self.db.commit()
+            self.writer.execute("UPDATE artists SET status=? WHERE id=?", (artist_status, artist_db_id))
+            self.writer.execute("UPDATE queue SET done=1 WHERE artist=?", (artist_name,))
+            self.writer.flush()
 
-    def run(self, artists: List[str]) -> None:
-        """Run the discography downloader for a list of artists."""
+    def preload(self, artists: List[str]) -> None:
+        """Queue artists, then store albums and tracks of every queued artist for later download."""
         start = time.time()
-        self.total_artists = len(artists)
-
-        if len(artists) > 5:
-            fiber = ChangeFiberIP("discography.sq3", "addresses")
-            if fiber.get_current_ip_age() > 2:
-                fiber.change_ip()
-
+        self._queue_artists(artists)
+        names = [row[0] for row in self.db.execute("SELECT artist FROM queue WHERE done=0 AND preloaded=0")]
+        self.total_artists = len(names)
+        asyncio.run(self._crawl(names))
+        self.ytm.close()
+        self.writer.flush()
+        self.database.close()
+        hms = str(datetime.timedelta(seconds=int(time.time() - start)))
+        print(f"=== {fg.li_blue}PRELOADED{fg.rs} {self.current_artist_idx} artists; {self.album_count} albums in {hms}")
+
+    async def _crawl(self, names: List[str]) -> None:
+        """Crawl artists with at most --concurrency API calls in flight, paced by a --rate token bucket."""
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=self.args.concurrency))
+        self.ytm.limiter = TokenBucket(self.args.rate).acquire  # Only calls that miss the cache are paced
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def crawl(artist_name: str) -> None:
+            async with semaphore:
+                await self._crawl_artist(artist_name)
+
+        await asyncio.gather(*(crawl(name) for name in names))
+
+    async def _crawl_artist(self, artist_name: str) -> None:
+        """Resolve one queued artist and fetch its artist page, album listings and albums concurrently."""
+        try:
+            artist_info, suggest = self.matcher.lookup(artist_name), ""
+            if not artist_info:
+                search_results = await asyncio.to_thread(self.ytm.search, artist_name, filter="artists")
+                artist_info, suggest = self._match_artist(artist_name, search_results)
+            if not artist_info:
+                self.writer.execute("UPDATE queue SET done=1, suggest=? WHERE artist=?", (suggest, artist_name))
+                return
+            artist_page = await asyncio.to_thread(self.ytm.get_artist, artist_info["browseId"])
+            albums = await asyncio.to_thread(self.parse_albums, artist_page, artist_info["artist"], None)
+            album_pages = await asyncio.gather(*(asyncio.to_thread(self.ytm.get_album, album["browseId"])
+                                                 for album in albums if "tracks" not in album))
+        except Exception as e:
+            error_msg = f"Failed to preload artist {artist_name}: {e}"
+            print(f"{fg.red}{error_msg}{fg.rs}")
+            self._write_error(error_msg)
+            return
+        self._store_preload(artist_name, artist_info["artist"], albums, album_pages)
+
+    def _store_preload(self, artist_name: str, artist_match: str, albums: List[Dict], album_pages: List[Dict]) -> None:
+        """Insert a crawled artist with its albums and tracks as PRELOAD rows and mark its queue row."""
+        preload = self.status_codes['PRELOAD']
+        artist_sane = self._sane_filename(artist_match)
+        self.writer.execute("INSERT INTO artists VALUES(NULL, ?, ?) ON CONFLICT(artist) DO NOTHING", (artist_sane, preload))
+        artist_db_id = self._db_fetch("SELECT id FROM artists WHERE artist=?", artist_sane)
+        pages = iter(album_pages)
+        for album in albums:
+            tracks = album["tracks"] if "tracks" in album else next(pages).get("tracks", [])
+            album_sane = self._sane_filename(album["title"])
+            self.writer.execute("INSERT INTO albums VALUES(NULL, ?, ?, ?) ON CONFLICT(artist_id, album) DO NOTHING",
+                                (artist_db_id, album_sane, preload))
+            album_db_id = self._db_fetch("SELECT id FROM albums WHERE artist_id=? AND album=?", (artist_db_id, album_sane))
+            self.writer.executemany("INSERT INTO tracks VALUES(NULL, ?, ?, ?) ON CONFLICT(album_id, track) DO NOTHING",
+                                    [(album_db_id, self._sane_filename(track["title"]), preload) for track in tracks])
+        self.writer.execute("UPDATE queue SET preloaded=1 WHERE artist=?", (artist_name,))
+        self.writer.flush()
+        self.current_artist_idx += 1
+        self.album_count += len(albums)
+        print(f"{self.current_artist_idx}/{self.total_artists}: {artist_match} {fg.li_blue}PRELOADED{fg.rs} {len(albums)} albums")
+
+    def _startup(self, rotate: bool) -> None:
+        """Rotate a stale public IP if asked to, and mark the start of the run in error.log.
+
+        Runs that rotate, and every daemon, also change the IP when throttled or out of IP budget, provided
+        the environment names a router.
+        """
+        if (rotate or self.args.daemon) and not ChangeFiberIP.configured():
+            print(f"{fg.li_blue}IP rotation disabled: set {', '.join(ChangeFiberIP.REQUIRED_SETTINGS)}{fg.rs}")
+        elif rotate or self.args.daemon:
+            if self.writer:
+                self.writer.flush()  # ChangeFiberIP writes through its own connection, release the write lock
+            self.fiber = ChangeFiberIP("discography.sq3", "addresses")
+            self.quota.rotate = self._rotate_ip
+            if rotate and (self.fiber.get_current_ip_age() or 0) > 2:
+                self._rotate_ip()
+            self.quota.ip = self.fiber._get_public_ip()
+
+        removed = self.engine.clean()
+        if removed:
+            print(f"{fg.li_blue}Removed {removed} stale files from {self.engine.incoming_dir}{fg.rs}")
         self._write_error(f"\n===== {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime())} =====")
-        for artist in artists:
-            if artist:
-                self.grab_discography(artist)
 
+    def _rotate_ip(self, ban: bool = False) -> bool:
+        """Run a cycle of IP changes, banning the current IP first with ban; a failed one is retried once due."""
+        if self.writer:
+            self.writer.flush()  # The router may take a while, do not hold the write lock meanwhile
+        with self.metrics.timer("stage_seconds", stage="ip_rotation"):
+            changed = self.fiber.change_ip(ban=ban)
+        self.metrics.count("ip_rotations", result="ok" if changed else "failed")
+        if not changed:
+            print(f"{fg.red}===== IP ROTATION FAILED: continuing, next try at "
+                  f"{time.strftime('%H:%M', time.localtime(self.fiber.next_cycle))} ====={fg.rs}")
+            return False
+        self.quota.ip = self.fiber._get_public_ip()
+        self.scheduler.reset()
+        return True
+
+    def _recover_from_throttling(self) -> None:
+        """Main thread, no download in flight: ban the throttled IP, change it and let the workers resume."""
+        try:
+            if self.stop.is_set():
+                return  # The handed back tracks come back as stopped
+            if self.fiber.failed_cycles and not self.fiber.cycle_due():
+                print(f"{fg.red}===== THROTTLED: next IP rotation at "
+                      f"{time.strftime('%H:%M', time.localtime(self.fiber.next_cycle))} ====={fg.rs}")
+                if self.writer:
+                    self.writer.flush()
+                if self.stop.wait(max(0, self.fiber.next_cycle - time.time())):
+                    return
+            print(f"{fg.red}===== THROTTLED: changing IP ====={fg.rs}")
+            self._write_error(f"THROTTLED: IP {self.quota.ip}, changing IP")
+            self._rotate_ip(ban=True)
+        finally:
+            self.scheduler.release()
+
+    def _retry_rotation(self) -> None:
+        """Between artists: run the next cycle of a failed IP rotation once it is due."""
+        if self.fiber and self.fiber.failed_cycles and self.fiber.cycle_due():
+            self._rotate_ip()
+
+    def _shutdown(self, start: float) -> None:
+        """Close the pipeline, metadata cache, router session and database, then print the totals of the run."""
+        self.pool.shutdown()
+        self.engine.close()
+        self.ytm.close()
+        if self.fiber:
+            self.fiber.close()
         if self.db:
-            self.db.close()
+            self.writer.flush()
+            self.database.close()
         end = time.time()
         elapsed = int(end - start)
         hms = str(datetime.timedelta(seconds=elapsed))
         per_hour = int((3600 / elapsed) * self.count_total) if elapsed else 0
         print(f"=== {fg.li_blue}DONE{fg.rs} {self.album_count} albums; {self.count_total} tracks in {hms}; {per_hour} tracks/hour")
+        print(f"=== {fg.li_blue}TIME{fg.rs} {self.metrics.summary('stage_seconds')}")
+        if self.args.metrics_file:
+            self.metrics.write(self.args.metrics_file)
+
+    def run(self, artists: List[str]) -> None:
+        """Run the discography downloader for a list of artists."""
+        start = time.time()
+        self.total_artists = len(artists)
+        self._startup(rotate=len(artists) > 5)
+        for artist in artists:
+            if artist:
+                self._retry_rotation()
+                self.grab_discography(artist)
+        self._shutdown(start)
+
+    def verify(self) -> None:
+        """Check every audio file of the library, re-queue the tracks of cut-off ones and flag the suspect ones."""
+        start = time.time()
+        files = []
+        for root, dirs, names in os.walk(self.args.output_dir):
+            dirs[:] = [name for name in dirs if not name.startswith(".")]
+            files.extend(os.path.join(root, name) for name in names
+                         if name.endswith(".part") or os.path.splitext(name)[1] in AUDIO_EXTENSIONS)
+        print(f"{fg.li_blue}VERIFY{fg.rs} {len(files)} files in {self.args.output_dir}")
+        artists = set()
+        corrupt = suspect = 0
+        for filename, problem in zip(files, self.pool.map(self._verify_file, files)):
+            if filename.endswith(".part"):
+                problem = "PARTIAL FILE"
+            if not problem:
+                continue
+            print(f"    {fg.red}{problem}{fg.rs} - {filename}")
+            if problem in TRUNCATED:
+                corrupt += 1
+                self._write_error(f'{problem}: "{filename}" removed by --verify')
+                os.remove(filename)
+            else:
+                suspect += 1  # Marked INCOMPLETE but not re-queued, a run would keep the file as it is
+                self._write_error(f'{problem}: "{filename}" kept by --verify, check it')
+            parts = os.path.relpath(filename, self.args.output_dir).split(os.sep)
+            if len(parts) != 3:
+                continue  # Not an artist/album/track file
+            artist, album, name = parts
+            track = re.sub(r"^\d+ - ", "", os.path.splitext(name.removesuffix(".part"))[0])
+            album_id = self._db_fetch("SELECT albums.id FROM albums JOIN artists ON artists.id=albums.artist_id "
+                                      "WHERE artists.artist=? AND albums.album=?", (artist, album))
+            if album_id:
+                self.writer.execute("UPDATE tracks SET status=? WHERE album_id=? AND track=?",
+                                    (self.status_codes['INCOMPLETE'], album_id, track))
+                self.writer.execute("UPDATE albums SET status=? WHERE id=?", (self.status_codes['INCOMPLETE'], album_id))
+            self.writer.execute("UPDATE artists SET status=? WHERE artist=?", (self.status_codes['INCOMPLETE'], artist))
+            if problem in TRUNCATED:
+                artists.add(artist)
+        # Queue by directory name, as --rescan does
+        self.writer.executemany("INSERT INTO queue (artist) VALUES(?) "
+                                "ON CONFLICT(artist) DO UPDATE SET done=0, lease=NULL, heartbeat=NULL",
+                                [(artist,) for artist in sorted(artists)])
+        self.pool.shutdown()
+        self.writer.flush()
+        self.database.close()
+        hms = str(datetime.timedelta(seconds=int(time.time() - start)))
+        print(f"=== {fg.li_blue}VERIFIED{fg.rs} {len(files)} files in {hms}; {corrupt} removed; {suspect} kept "
+              f"to check; {len(artists)} artists re-queued")
+
+    def _album_pages(self, artist_name: str) -> Optional[Dict[str, Dict]]:
+        """Return {sanitized title: album with tracks} of an artist's discography, None if it is not found."""
+        self.writer.flush()  # Do not hold the write lock across the API calls
+        artist_info, _ = self._resolve_artist(artist_name)
+        if not artist_info:
+            return None
+        albums = self.parse_albums(self.ytm.get_artist(artist_info["browseId"]), artist_info["artist"], None)
+        pages = {}
+        for album in albums:
+            if "tracks" not in album:
+                page = self.ytm.get_album(album["browseId"])
+                # Listing fields as the download pass tags them, tracks and full size cover from the album page
+                album = {**page, **album, "thumbnails": page.get("thumbnails") or album.get("thumbnails")}
+            pages[self._sane_filename(album["title"])] = album
+        return pages
+
+    def tag_library(self) -> None:
+        """Tag every NOMETADATA track in a process pool, one task per album that fetches its cover once."""
+        start = time.time()
+        rows = self.db.execute("""
+            SELECT artists.id, artists.artist, albums.id, albums.album, tracks.id, tracks.track FROM tracks
+            JOIN albums ON albums.id=tracks.album_id JOIN artists ON artists.id=albums.artist_id
+            WHERE tracks.status=? ORDER BY artists.id, albums.id
+        """, (self.status_codes['NOMETADATA'],)).fetchall()
+        artists = collections.defaultdict(lambda: collections.defaultdict(dict))  # Artist -> album -> {track: id}
+        for artist_id, artist, album_id, album, track_id, track in rows:
+            artists[(artist_id, artist)][(album_id, album)][track] = track_id
+        print(f"{fg.li_blue}TAG{fg.rs} {len(rows)} tracks of {len(artists)} artists")
+
+        tagged_total = 0
+        futures = {}  # Future -> (artist id, album id)
+        with ProcessPoolExecutor() as pool:
+            for (artist_id, artist), albums in artists.items():
+                try:
+                    pages = self._album_pages(artist)
+                except Exception as e:
+                    self._write_error(f"TAG ERROR: metadata of {artist} not found: {e}")
+                    continue
+                if pages is None:
+                    print(f"{artist} {fg.red}NOT FOUND{fg.rs}")
+                    continue
+                for (album_id, album), tracks in albums.items():
+                    page = pages.get(album)
+                    if not page:
+                        print(f"  {artist} -- {album} {fg.red}NOT FOUND{fg.rs}")
+                        continue
+                    album_path = os.path.join(self.args.output_dir, artist, album)
+                    files = []
+                    for track in page.get("tracks", []):
+                        song_sane = self._sane_filename(track["title"])
+                        if song_sane not in tracks:
+                            continue
+                        number = track.get("trackNumber")
+                        filename = self._existing_file(os.path.join(
+                            album_path, f"{number} - {song_sane}" if number is not None else song_sane))
+                        if filename:
+                            files.append((tracks[song_sane], filename, tag_fields(page, track)))
+                    if files:
+                        cover = (page.get("thumbnails") or [{}])[-1].get("url")
+                        futures[pool.submit(tag_album, files, cover)] = (artist_id, album_id)
+                self.file_index.clear()
+            for future in futures:
+                artist_id, album_id = futures[future]
+                for track_id, tagged, note in future.result():
+                    if tagged:
+                        tagged_total += 1
+                        self.writer.execute("UPDATE tracks SET status=? WHERE id=?", (self.status_codes['FINISHED'], track_id))
+                    else:
+                        self._write_error(f"TAG ERROR: track {track_id}{note}")
+                # An album or artist takes the lowest status of its parts, as in grab_discography
+                self.writer.execute("UPDATE albums SET status=(SELECT MIN(status) FROM tracks WHERE album_id=?) "
+                                    "WHERE id=?", (album_id, album_id))
+                self.writer.execute("UPDATE artists SET status=(SELECT MIN(status) FROM albums WHERE artist_id=?) "
+                                    "WHERE id=?", (artist_id, artist_id))
+        self.pool.shutdown()
+        self.ytm.close()
+        self.writer.flush()
+        self.database.close()
+        hms = str(datetime.timedelta(seconds=int(time.time() - start)))
+        print(f"=== {fg.li_blue}TAGGED{fg.rs} {tagged_total} of {len(rows)} tracks in {hms}")
+
+    def _queue_artists(self, artists: List[str]) -> None:
+        """Add artists to the queue, ignoring those already in it."""
+        self.writer.executemany("INSERT INTO queue (artist) VALUES(?) ON CONFLICT(artist) DO NOTHING",
+                                [(artist,) for artist in artists if artist])
+        self.writer.flush()
+
+    def _claim_artist(self) -> Optional[str]:
+        """Lease the first queued artist that no daemon holds; expired leases are taken over."""
+        now = time.time()
+        row = self.db.execute("""
+            UPDATE queue SET worker=?, lease=?, heartbeat=?
+            WHERE rowid=(SELECT rowid FROM queue WHERE done=0 AND (lease IS NULL OR lease<?) ORDER BY rowid LIMIT 1)
+            RETURNING artist
+        """, (self.worker, now + LEASE_SECONDS, now, now)).fetchone()
+        # Other daemons must see the claim at once, and the UPDATE holds the write lock even if it matched nothing
+        self.writer.commit()
+        return row[0] if row else None
+
+    def _release_artist(self, artist: str, retry_after: float = 0) -> None:
+        """Give up the lease on artist; an unfinished one can be claimed again after retry_after seconds."""
+        self.writer.execute("UPDATE queue SET lease=?, heartbeat=NULL WHERE artist=? AND worker=?",
+                            (time.time() + retry_after if retry_after else None, artist, self.worker))
+        self.writer.flush()
+
+    def _keep_lease(self, artist: str, released: threading.Event) -> None:
+        """Heartbeat thread: extend the lease on artist until it is released."""
+        db = self.database.connect()  # Own connection, the main one belongs to the main thread
+        while not released.wait(LEASE_HEARTBEAT):
+            now = time.time()
+            try:
+                if not db.execute("UPDATE queue SET lease=?, heartbeat=? WHERE artist=? AND worker=?",
+                                  (now + LEASE_SECONDS, now, artist, self.worker)).rowcount:
+                    print(f"{fg.red}===== LEASE LOST: {artist} was claimed by another worker ====={fg.rs}")
+                db.commit()
+            except sqlite3.Error as e:
+                # A busy database must not kill the heartbeat, the next beat tries again before the lease runs out
+                print(f"{fg.red}===== LEASE HEARTBEAT FAILED: {artist}: {e} ====={fg.rs}")
+                if db.in_transaction:
+                    db.rollback()
+        db.close()
+
+    def _request_stop(self, signum, frame) -> None:
+        """SIGTERM handler: finish the downloads in flight and stop; a second signal exits at once."""
+        if self.stop.is_set():
+            sys.exit("Terminated")
+        print(f"\n{fg.red}===== STOPPING: finishing downloads in flight ====={fg.rs}")
+        self.stop.set()
+        self.scheduler.wake()
+
+    def daemon(self, artists: List[str]) -> None:
+        """Serve the queue until SIGTERM: download queued artists, then poll for new ones."""
+        start = time.time()
+        if self.database.is_shared():
+            sys.exit(f"discography.sq3 is on {self.database.filesystem()}: daemons sharing the queue must run on "
+                     f"the host that stores it, WAL does not work across machines")
+        signal.signal(signal.SIGTERM, self._request_stop)
+        self.worker = self.args.worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.quota.node = self.worker.split(":")[0]
+        self._queue_artists(artists)
+        self._startup(rotate=self._db_fetch("SELECT COUNT(*) FROM queue WHERE done=0") > 5)
+        print(f"{fg.li_blue}WORKER{fg.rs} {self.worker}")
+        while not self.stop.is_set():
+            artist = self._claim_artist()
+            if not artist:
+                self.stop.wait(self.args.poll)
+                continue
+            self.current_artist_idx = 0
+            self.total_artists = self._db_fetch("SELECT COUNT(*) FROM queue WHERE done=0")
+            released = threading.Event()
+            threading.Thread(target=self._keep_lease, args=(artist, released), daemon=True).start()
+            try:
+                self._retry_rotation()
+                self.grab_discography(artist)
+            finally:
+                released.set()
+                # A stopped daemon hands its artist straight back; one still queued otherwise, e.g. after
+                # a failed search, waits before any daemon retries it
+                self._release_artist(artist, 0 if self.stop.is_set() else self.args.retry_after)
+        self._shutdown(start)
+
+def positive_int(value: str) -> int:
+    """argparse type: an integer of at least 1."""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, not {value}")
+    return number
+
+def positive_float(value: str) -> float:
+    """argparse type: a number greater than 0."""
+    number = float(value)
+    if not number > 0:
+        raise argparse.ArgumentTypeError(f"must be greater than 0, not {value}")
+    return number
 
 def main():
     """Parse arguments and start the downloader."""
@@ -706,11 +1901,31 @@ def main():
     parser.add_argument('--no-database', action='store_true', help='do not use database')
     parser.add_argument('--rescan', action='store_true', help='rescan for missing metadata or songs')
     parser.add_argument('--preload', action='store_true', help='preload artists for daemon')
-    parser.add_argument('--status', action='store_true', help='show daemon status')
+    parser.add_argument('--status', action='store_true', help='show queue and download progress')
+    parser.add_argument('--verify', action='store_true', help='remove corrupt files and re-queue their artists')
+    parser.add_argument('--tag', action='store_true', help='tag downloaded tracks that have no metadata yet')
     parser.add_argument('--daemon', action='store_true', help='run as daemon, implies --delay')
+    parser.add_argument('--poll', metavar='SECONDS', type=int, default=60, help='daemon: check an idle queue this often')
+    parser.add_argument('--retry-after', metavar='SECONDS', type=int, default=3600, help='daemon: retry artists left in the queue after this long')
+    parser.add_argument('--worker-id', metavar='ID', type=str, default='', help='daemon: name in queue leases, default host:pid')
     parser.add_argument('--batch_limit', metavar='LIMIT', type=int, default=0, help='limit per batch')
+    parser.add_argument('--refresh-metadata', action='store_true', help='ignore cached YouTube Music metadata')
+    parser.add_argument('--container-only', action='store_true', help='remux native opus/m4a audio instead of re-encoding')
+    parser.add_argument('--concurrency', metavar='N', type=positive_int, default=8, help='parallel API calls for --preload and the pages of singles')
+    parser.add_argument('--rate', metavar='R', type=positive_float, default=2.0, help='API calls per second of those parallel calls')
+    parser.add_argument('-w', '--workers', metavar='N', type=positive_int, default=1, help='download N tracks of an album concurrently')
+    parser.add_argument('--metrics-file', metavar='FILE', type=str, default='', help='write a JSON metrics snapshot every minute')
+    parser.add_argument('--metrics-port', metavar='PORT', type=int, default=0, help='serve Prometheus metrics on PORT/metrics')
+    parser.add_argument('--metrics-host', metavar='HOST', type=str, default='127.0.0.1', help='interface for --metrics-port, 0.0.0.0 for all')
     args = parser.parse_args()
 
+    if args.status:
+        StatusReport("discography.sq3").show()
+        return
+
+    # Turn SIGTERM into SystemExit so pending database writes are flushed on the way out
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit("Terminated"))
+
     if args.output_dir.endswith("/"):
         args.output_dir = args.output_dir[:-1]
     if args.daemon:
@@ -718,27 +1933,34 @@ def main():
 
     artists = []
     if args.rescan:
-        artists = os.listdir(args.output_dir)
+        artists = [name for name in os.listdir(args.output_dir) if not name.startswith(".")]
     if args.file:
         with open(args.file, "r") as f:
             artists.extend(line.strip() for line in f if line.strip())
     artists.extend(args.artists)
-    if args.daemon and not args.no_database:
-        db = sqlite3.connect("discography.sq3")
-        artists = db.execute("SELECT GROUP_CONCAT(artist,'|') FROM queue WHERE done=0").fetchone()[0].split("|")
-        db.close()
     if args.batch_limit:
         global BATCH_LIMIT
         BATCH_LIMIT = args.batch_limit
+    if (args.preload or args.daemon or args.verify or args.tag) and args.no_database:
+        sys.exit("ERROR: --preload, --daemon, --verify and --tag need the database.")
+    if args.tag:
+        DiscographyDownloader(args).tag_library()
+        return
+    if args.verify:
+        DiscographyDownloader(args).verify()
+        return
+    if args.preload:
+        DiscographyDownloader(args).preload(artists)
+        return
+    if args.daemon:
+        DiscographyDownloader(args).daemon(artists)
+        return
     if not artists:
         print("ERROR: At least one artist or a --file artist list is required, none left in queue.")
         sys.exit()
 
     downloader = DiscographyDownloader(args)
-    if not args.no_database:
-        downloader._count_db(check_only=True)
-    else:
-        downloader._count_file(check_only=True)
+    downloader.quota.check()
     downloader.run(artists)
 
 if __name__ == "__main__":
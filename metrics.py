@@ -0,0 +1,140 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+
+BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900)  # Histogram bounds in seconds
+SNAPSHOT_INTERVAL = 60  # Seconds between two JSON snapshot files
+PREFIX = "discography_"  # Prometheus metric name prefix
+HOST = "127.0.0.1"  # Interface the Prometheus endpoint listens on unless told otherwise
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Metrics:
+    """Thread-safe counters and timing histograms of a run, exported as Prometheus text or a JSON snapshot."""
+
+    def __init__(self, buckets: Tuple[float, ...] = BUCKETS):
+        """Initialize empty metrics; every histogram uses the same bucket bounds."""
+        self.buckets = buckets
+        self.started = time.time()
+        self.counters: Dict[Tuple[str, Labels], float] = collections.Counter()
+        self.histograms: Dict[Tuple[str, Labels], List] = {}  # -> [bucket counts, count, sum]
+        self.lock = threading.Lock()
+
+    def count(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add value to a counter."""
+        with self.lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """Record a duration in a histogram."""
+        with self.lock:
+            histogram = self.histograms.setdefault((name, tuple(sorted(labels.items()))),
+                                                   [[0] * len(self.buckets), 0, 0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    histogram[0][i] += 1
+            histogram[1] += 1
+            histogram[2] += seconds
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Record the duration of the with block in a histogram, also when it raises."""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(name, time.monotonic() - started, **labels)
+
+    def _label_text(self, labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+        """Format labels as {name="value",...}, empty without labels."""
+        pairs = list(labels) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def prometheus(self) -> str:
+        """Return all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self.histograms.items())
+        lines = [f"# TYPE {PREFIX}uptime_seconds gauge", f"{PREFIX}uptime_seconds {time.time() - self.started:.3f}"]
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name}_total counter")
+                typed.add(name)
+            lines.append(f"{PREFIX}{name}_total{self._label_text(labels)} {value:g}")
+        for (name, labels), (buckets, count, total) in histograms:
+            if name not in typed:
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+                typed.add(name)
+            for bound, bucket_count in zip(self.buckets, buckets):
+                lines.append(f"{PREFIX}{name}_bucket{self._label_text(labels, ('le', f'{bound:g}'))} {bucket_count}")
+            lines.append(f"{PREFIX}{name}_bucket{self._label_text(labels, ('le', '+Inf'))} {count}")
+            lines.append(f"{PREFIX}{name}_sum{self._label_text(labels)} {total:.6f}")
+            lines.append(f"{PREFIX}{name}_count{self._label_text(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict:
+        """Return all metrics as a JSON-serializable dict."""
+        with self.lock:
+            return {
+                "time": time.time(),
+                "uptime": time.time() - self.started,
+                "counters": [{"name": name, "labels": dict(labels), "value": value}
+                             for (name, labels), value in sorted(self.counters.items())],
+                "histograms": [{"name": name, "labels": dict(labels), "count": count, "sum": total,
+                                "buckets": dict(zip((f"{bound:g}" for bound in self.buckets), buckets))}
+                               for (name, labels), (buckets, count, total) in sorted(self.histograms.items())],
+            }
+
+    def write(self, filename: str) -> None:
+        """Write a JSON snapshot; readers never see a half-written file."""
+        with open(filename + ".tmp", "w") as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(filename + ".tmp", filename)
+
+    def write_every(self, filename: str, stop: threading.Event, interval: float = SNAPSHOT_INTERVAL) -> None:
+        """Write a JSON snapshot every interval seconds from a background thread until stop is set."""
+        def writer() -> None:
+            while not stop.wait(interval):
+                self.write(filename)
+
+        threading.Thread(target=writer, daemon=True).start()
+
+    def serve(self, port: int, host: str = HOST) -> ThreadingHTTPServer:
+        """Serve the Prometheus text on http://host:port/metrics from a background thread."""
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass  # Scrapes would flood the download output
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def summary(self, name: str) -> str:
+        """Return the total seconds and count of every histogram of a name, longest first."""
+        with self.lock:
+            totals = [(total, count, dict(labels)) for (histogram, labels), (_, count, total)
+                      in self.histograms.items() if histogram == name]
+        return "; ".join(f"{' '.join(labels.values()) or name} {total:.0f}s/{count}"
+                         for total, count, labels in sorted(totals, key=lambda t: t[0], reverse=True))
@@ -0,0 +1,79 @@
+import music_tag
+import requests
+from typing import Dict, List, Optional, Tuple
+
+CRITICAL_FIELDS = ("album", "artist")  # A track counts as tagged only if these were written
+
+
+def tag_fields(album: Dict, track: Dict) -> Dict:
+    """Build the tag values of a track from its YouTube Music album and track metadata."""
+    track_year = track.get("year", album.get("year", ""))
+    return {
+        "album": album.get("title", ""),
+        "artist": track["artists"][0]["name"] if track.get("artists") and track["artists"][0].get("name") else "",
+        "year": "" if track_year in ["Single", "EP"] else track_year,
+        "tracktitle": track.get("title", ""),
+        "tracknumber": track.get("trackNumber", 0),
+    }
+
+
+def write_tags(filename: str, fields: Dict, artwork: Optional[bytes] = None) -> Tuple[bool, str]:
+    """Set all fields of a file and save it once, returning True if album and artist are set, and a status note."""
+    try:
+        tags = music_tag.load_file(filename)
+    except NotImplementedError:
+        return False, ""
+    if (all(fields.get(name) and str(tags[name]) == str(fields[name]) for name in CRITICAL_FIELDS)
+            and (not artwork or tags["artwork"].values)):
+        return True, " -- already tagged"  # Saving again would only rewrite the file
+
+    success = True
+    incomplete_fields = []
+    for name, value in fields.items():
+        try:
+            tags[name] = value
+        except Exception as e:
+            if name in CRITICAL_FIELDS:
+                incomplete_fields.append(f"{name}: {e}")
+                success = False
+            else:
+                incomplete_fields.append(name)
+    if artwork:
+        try:
+            tags["artwork"] = artwork
+        except Exception:
+            incomplete_fields.append("artwork")
+
+    if incomplete_fields:
+        note = f" -- Metadata OK: no {', '.join(incomplete_fields)}"
+    else:
+        note = " -- got metadata"
+
+    if success:
+        tags.save()
+    return success, note
+
+
+def fetch_cover(url: Optional[str]) -> Optional[bytes]:
+    """Download album cover art, None if there is no URL or it cannot be fetched."""
+    if not url:
+        return None
+    try:
+        response = requests.get(url, timeout=30)
+        response.raise_for_status()
+        return response.content
+    except requests.RequestException:
+        return None
+
+
+def tag_album(files: List[Tuple[int, str, Dict]], cover_url: Optional[str]) -> List[Tuple[int, bool, str]]:
+    """Process pool task: fetch an album's cover once and tag its (id, file, fields) tracks with it."""
+    artwork = fetch_cover(cover_url)
+    results = []
+    for track_id, filename, fields in files:
+        try:
+            tagged, note = write_tags(filename, fields, artwork)
+        except Exception as e:
+            tagged, note = False, f" -- TAG ERROR {e}"
+        results.append((track_id, tagged, note))
+    return results
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pytest
+
+for module in ("music_tag", "sanitize_filename", "sty", "ytmusicapi", "paramiko", "requests"):
+    pytest.importorskip(module)
+
+from database import Database
+from fetch_artist_discography import DiscographyDownloader, WriteBatcher
+
+
+def daemon(sqlite3_file, worker):
+    """Return a downloader with just the state _claim_artist needs, on its own connection."""
+    downloader = DiscographyDownloader.__new__(DiscographyDownloader)
+    downloader.database = Database(sqlite3_file, busy_timeout=0.5)
+    downloader.db = downloader.database.connect()
+    downloader._migrate_database(downloader.db)
+    downloader.writer = WriteBatcher(downloader.db)
+    downloader.worker = worker
+    return downloader
+
+
+@pytest.fixture
+def daemons(tmp_path):
+    sqlite3_file = str(tmp_path / "discography.sq3")
+    first, second = daemon(sqlite3_file, "a:1"), daemon(sqlite3_file, "b:2")
+    yield first, second
+    first.db.close()
+    second.db.close()
+
+
+def test_claim_is_committed_and_visible(daemons):
+    first, second = daemons
+    first.db.executemany("INSERT INTO queue (artist) VALUES (?)", [("one",), ("two",)])
+    first.db.commit()
+
+    assert first._claim_artist() == "one"
+    assert not first.db.in_transaction
+    assert second.db.execute("SELECT worker FROM queue WHERE artist='one'").fetchone()[0] == "a:1"
+    assert second._claim_artist() == "two"
+
+
+def test_empty_queue_claim_releases_write_lock(daemons):
+    first, second = daemons
+
+    assert first._claim_artist() is None
+    assert not first.db.in_transaction
+    try:
+        second.db.execute("INSERT INTO queue (artist) VALUES ('late')")
+        second.db.commit()
+    except sqlite3.OperationalError as e:
+        pytest.fail(f"idle daemon still holds the write lock: {e}")
+    assert first._claim_artist() == "late"
@@ -0,0 +1,107 @@
+import json
+import threading
+import time
+import zlib
+from typing import Any, Callable, Dict, Optional
+from database import Database
+
+DAY = 86400
+
+# Seconds a cached response stays valid, per YTMusic method
+CACHE_TTL = {
+    "search": 7 * DAY,
+    "get_artist": 1 * DAY,
+    "get_artist_albums": 1 * DAY,
+    "get_album": 30 * DAY,
+    "get_playlist": 7 * DAY,
+}
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+
+class CachedYTMusic:
+    """Wraps a YTMusic client and keeps its metadata responses in an SQLite file across runs."""
+
+    def __init__(self, ytm, sqlite3_file: str, refresh: bool = False, ttl: Optional[Dict[str, int]] = None,
+                 max_bytes: int = CACHE_MAX_BYTES):
+        """Initialize cache; with refresh, every call goes to the API and only updates the cache."""
+        self.ytm = ytm
+        self.refresh = refresh
+        self.ttl = ttl or CACHE_TTL
+        self.max_bytes = max_bytes
+        self.limiter: Optional[Callable[[], None]] = None  # Called before every request that reaches the API
+        self.metrics = None  # Metrics that count calls and time the requests that reach the API
+        self.lock = threading.Lock()  # One connection shared by all threads
+        self.db = Database(sqlite3_file).connect(check_same_thread=False)  # Shared by daemon and --preload
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                method TEXT,
+                created REAL,
+                size INTEGER,
+                value BLOB
+            )
+        """)
+        self.db.execute("CREATE INDEX IF NOT EXISTS responses_created ON responses (created)")
+        self.db.commit()
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def __getattr__(self, name: str) -> Any:
+        """Serve cached methods from the cache, pass everything else straight to YTMusic."""
+        attr = getattr(self.ytm, name)
+        if name not in self.ttl or not callable(attr):
+            return attr
+        return lambda *args, **kwargs: self._call(name, attr, args, kwargs)
+
+    def _call(self, method: str, func, args: tuple, kwargs: dict) -> Any:
+        """Return a fresh cached response for the call, or call the API and store the result."""
+        key = json.dumps([method, args, kwargs], sort_keys=True, default=str)
+        if not self.refresh:
+            with self.lock:
+                row = self.db.execute("SELECT created, value FROM responses WHERE key=?", (key,)).fetchone()
+            if row and time.time() - row[0] < self.ttl[method]:
+                self.hits += 1
+                if self.metrics:
+                    self.metrics.count("api_calls", method=method, cache="hit")
+                return json.loads(zlib.decompress(row[1]))
+        self.misses += 1
+        if self.limiter:
+            self.limiter()
+        started = time.monotonic()
+        result = func(*args, **kwargs)
+        if self.metrics:
+            self.metrics.observe("api_seconds", time.monotonic() - started, method=method)
+            self.metrics.count("api_calls", method=method, cache="miss")
+        self._store(key, method, result)
+        return result
+
+    def _store(self, key: str, method: str, result: Any) -> None:
+        """Save a response, then evict the oldest entries while the cache is over max_bytes."""
+        value = zlib.compress(json.dumps(result).encode())
+        with self.lock:
+            old = self.db.execute("SELECT size FROM responses WHERE key=?", (key,)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO responses VALUES(?, ?, ?, ?, ?)",
+                            (key, method, time.time(), len(value), value))
+            self.size += len(value) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+            self.db.commit()
+
+    def _evict(self) -> None:
+        """Delete expired entries, then the oldest ones, until the cache is at 90% of max_bytes."""
+        now = time.time()
+        for method, ttl in self.ttl.items():
+            self.db.execute("DELETE FROM responses WHERE method=? AND created<?", (method, now - ttl))
+        self.size = self.db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        target = self.max_bytes * 0.9
+        for key, size in self.db.execute("SELECT key, size FROM responses ORDER BY created").fetchall():
+            if self.size <= target:
+                break
+            self.db.execute("DELETE FROM responses WHERE key=?", (key,))
+            self.size -= size
+
+    def close(self) -> None:
+        """Close the cache database."""
+        with self.lock:
+            self.db.close()